@@ -1,10 +1,27 @@
 import asyncio
+import base64
+import bisect
+import contextvars
+import copy
+import hashlib
+import heapq
+import hmac
 import itertools
+import json
 import logging
+import mimetypes
+import multiprocessing
+import os
+import pathlib
+import pickle
+import re
+import sqlite3
 import time
 import uuid
-from collections.abc import Awaitable
-from typing import Any, cast, Dict
+import weakref
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from typing import Any, cast, Dict, NamedTuple
 
 from aiocqhttp import CQHttp, Event
 from aiocqhttp.exceptions import ActionFailed
@@ -26,6 +43,1102 @@ from .aiocqhttp_message_event import *
 from .aiocqhttp_message_event import AiocqhttpMessageEvent
 
 
+def _create_detached_task(coro) -> asyncio.Task:
+    """在空白的上下文中创建长期运行的任务。
+
+    aiocqhttp 以上下文变量记录当前事件所属的 WebSocket 连接，并据此发送未指定 self_id 的 API 调用。
+    在事件回调中直接创建的任务会继承首个事件所在连接，之后处理其他账号的事件时也沿用该连接。
+    """
+    return contextvars.Context().run(asyncio.create_task, coro)
+
+
+class _TTLCache:
+    """带过期时间的 LRU 缓存，记录命中/未命中次数"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Any:
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def dump(self) -> list[tuple[Hashable, Any, float]]:
+        """导出未过期的条目，过期时间换算为墙上时间"""
+        now, wall = time.monotonic(), time.time()
+        return [
+            (key, value, wall + expires_at - now)
+            for key, (expires_at, value) in self._data.items()
+            if expires_at > now
+        ]
+
+    def load(self, items: list[tuple[Hashable, Any, float]]) -> None:
+        now, wall = time.monotonic(), time.time()
+        for key, value, expires_at in items:
+            if expires_at > wall:
+                self._data[key] = (now + expires_at - wall, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class _DeadlineScheduler:
+    """由单个后台任务驱动的截止时间调度器
+
+    推迟截止时间只修改字典，堆中过时的条目在到期检查时惰性修正；
+    同一轮到期的键批量交给回调处理。
+    """
+
+    def __init__(self, callback: Callable[[list[str]], Awaitable[None]]) -> None:
+        self._callback = callback
+        self._deadlines: dict[str, float] = {}
+        self._heap: list[tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def schedule(self, key: str, delay: float) -> None:
+        """设置 key 在 delay 秒后到期，覆盖之前的截止时间"""
+        deadline = time.monotonic() + delay
+        current = self._deadlines.get(key)
+        self._deadlines[key] = deadline
+        if current is None or deadline < current:
+            heapq.heappush(self._heap, (deadline, key))
+            if self._heap[0][0] == deadline:
+                self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = _create_detached_task(self._run())
+
+    def cancel(self, key: str) -> None:
+        self._deadlines.pop(key, None)
+
+    def remaining(self, key: str) -> float | None:
+        """距离到期的剩余秒数，未调度时返回 None"""
+        deadline = self._deadlines.get(key)
+        return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def close(self) -> None:
+        """取消所有截止时间并停止后台任务"""
+        self._deadlines.clear()
+        self._heap.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            expired = []
+            while self._heap and self._heap[0][0] <= now:
+                _, key = heapq.heappop(self._heap)
+                deadline = self._deadlines.get(key)
+                if deadline is None:
+                    continue
+                if deadline > now:
+                    heapq.heappush(self._heap, (deadline, key))
+                    continue
+                del self._deadlines[key]
+                expired.append(key)
+            if expired:
+                try:
+                    await self._callback(expired)
+                except Exception as e:
+                    logger.error(f"处理到期任务出错: {e}")
+                continue
+
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+class _AdaptiveWait:
+    """按会话学习分段消息的到达间隔（EWMA），据此给出聚合等待时间"""
+
+    def __init__(
+        self,
+        default: float,
+        multiplier: float,
+        min_wait: float,
+        max_wait: float,
+        alpha: float,
+        maxsize: int,
+    ) -> None:
+        self.default = default
+        self.multiplier = multiplier
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.alpha = alpha
+        self.maxsize = maxsize
+        # 会话 -> (上一段到达时间, 间隔的 EWMA)
+        self._stats: OrderedDict[str, tuple[float, float | None]] = OrderedDict()
+
+    def observe(self, key: str, is_new: bool = False) -> float:
+        """记录一段消息的到达，返回本次应等待的时间。
+
+        is_new 表示该段开启了新的缓冲区：与上一段之间隔着上一轮的回复，不是分段间隔，不参与学习。
+        """
+        now = time.monotonic()
+        last, ewma = self._stats.pop(key, (None, None))
+        # 超过等待上限的间隔同样视为新一轮输入
+        if not is_new and last is not None and now - last <= self.max_wait:
+            gap = now - last
+            ewma = gap if ewma is None else self.alpha * gap + (1 - self.alpha) * ewma
+        self._stats[key] = (now, ewma)
+        while len(self._stats) > self.maxsize:
+            self._stats.popitem(last=False)
+        wait = self.default if ewma is None else ewma * self.multiplier
+        return min(max(wait, self.min_wait), self.max_wait)
+
+    def __len__(self) -> int:
+        return len(self._stats)
+
+
+class EndOfUtteranceDetector:
+    """判断用户的分段输入是否已经说完
+
+    规则为 (当前消息, 缓冲区内含当前消息在内的全部消息) -> 剩余等待秒数 的函数，
+    返回 0 表示立即处理，返回 None 表示不作判断；多条规则取最小值。
+    插件可通过适配器的 eou_detector.register() 追加规则。
+    """
+
+    def __init__(self) -> None:
+        self.rules: list[Callable[[AstrBotMessage, list[AstrBotMessage]], float | None]] = []
+
+    def register(self, rule: Callable[[AstrBotMessage, list[AstrBotMessage]], float | None]) -> None:
+        self.rules.append(rule)
+
+    def check(self, message: AstrBotMessage, buffered: list[AstrBotMessage]) -> float | None:
+        result = None
+        for rule in self.rules:
+            try:
+                wait = rule(message, buffered)
+            except Exception as e:
+                logger.error(f"输入结束判断规则出错: {e}")
+                continue
+            if wait is not None and (result is None or wait < result):
+                result = wait
+        return result
+
+
+# 耗时直方图各桶的上界（秒）
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# 各指标标签的名称，未列出的指标使用 type
+_METRIC_LABELS = {
+    "api_call": "action", "api_errors": "action", "api_timeouts": "action",
+    "convert": "post_type", "events": "post_type",
+    "commit_queue": "priority", "committed": "priority",
+}
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(_LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """按桶估算分位数，返回所在桶的上界"""
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(_LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class _Metrics:
+    """各处理阶段的耗时直方图与计数器，关闭时记录操作直接返回"""
+
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self._timers: Dict[tuple[str, str], _Histogram] = {}
+        self._counters: Dict[tuple[str, str], int] = {}
+
+    def observe(self, name: str, seconds: float, label: str = "") -> None:
+        if not self.enabled:
+            return
+        histogram = self._timers.get((name, label))
+        if histogram is None:
+            histogram = self._timers[(name, label)] = _Histogram()
+        histogram.observe(seconds)
+
+    def incr(self, name: str, label: str = "", n: int = 1) -> None:
+        if self.enabled:
+            self._counters[(name, label)] = self._counters.get((name, label), 0) + n
+
+    def snapshot(self) -> dict:
+        timers: Dict[str, dict] = {}
+        for (name, label), histogram in self._timers.items():
+            timers.setdefault(name, {})[label] = histogram.snapshot()
+        counters: Dict[str, dict] = {}
+        for (name, label), n in self._counters.items():
+            counters.setdefault(name, {})[label] = n
+        return {"timers": timers, "counters": counters}
+
+    def export(self) -> dict:
+        """可跨进程传递的原始数据"""
+        return {
+            "timers": {key: (h.counts[:], h.count, h.sum, h.max) for key, h in self._timers.items()},
+            "counters": dict(self._counters),
+        }
+
+    @classmethod
+    def from_export(cls, export: dict) -> "_Metrics":
+        metrics = cls(True)
+        for key, (counts, count, total, maximum) in export["timers"].items():
+            histogram = metrics._timers[key] = _Histogram()
+            histogram.counts, histogram.count, histogram.sum, histogram.max = counts, count, total, maximum
+        metrics._counters = dict(export["counters"])
+        return metrics
+
+    @staticmethod
+    def render_prometheus(exports: list[tuple[str, dict]], prefix: str) -> list[str]:
+        """将若干份 export() 数据渲染为 Prometheus 文本格式，每份附带一组额外标签"""
+        lines = []
+        timers: Dict[str, list] = {}
+        counters: Dict[str, list] = {}
+        for extra, export in exports:
+            for (name, label), value in export["timers"].items():
+                timers.setdefault(name, []).append((extra, label, value))
+            for (name, label), value in export["counters"].items():
+                counters.setdefault(name, []).append((extra, label, value))
+
+        def labels(name: str, extra: str, label: str, *more: str) -> str:
+            parts = [p for p in (extra, f'{_METRIC_LABELS.get(name, "type")}="{label}"' if label else "", *more) if p]
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for name, series in timers.items():
+            metric = f"{prefix}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for extra, label, (counts, count, total, _) in series:
+                cumulative = 0
+                for bound, n in zip((*_LATENCY_BUCKETS, "+Inf"), counts):
+                    cumulative += n
+                    le = f'le="{bound}"'
+                    lines.append(f"{metric}_bucket{labels(name, extra, label, le)} {cumulative}")
+                lines.append(f"{metric}_sum{labels(name, extra, label)} {total}")
+                lines.append(f"{metric}_count{labels(name, extra, label)} {count}")
+        for name, series in counters.items():
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for extra, label, n in series:
+                lines.append(f"{metric}{labels(name, extra, label)} {n}")
+        return lines
+
+
+class _ShardedWorkers:
+    """按会话哈希分片的事件处理队列：同一会话按顺序处理，不同会话并行处理"""
+
+    def __init__(
+        self,
+        shards: int,
+        maxsize: int,
+        handler: Callable[[Event], Awaitable[None]],
+        metrics: _Metrics,
+    ) -> None:
+        self._queues: list[asyncio.Queue] = [asyncio.Queue(maxsize) for _ in range(shards)]
+        self._handler = handler
+        self._metrics = metrics
+        self._tasks: list[asyncio.Task] = []
+        self.processed = 0
+        self.full_waits = 0
+
+    async def submit(self, key: str, event: Event) -> None:
+        """分片队列已满时等待。
+
+        aiocqhttp 为每个 WebSocket 消息单独创建任务，等待只会让这些任务挂起，并不会减缓接收，
+        因此队列长度上限不能限制积压，只用于发现积压：记录队列已满的次数。
+        """
+        if not self._tasks:
+            self._tasks = [_create_detached_task(self._work(q)) for q in self._queues]
+        queue = self._queues[hash(key) % len(self._queues)]
+        if queue.full():
+            self.full_waits += 1
+            self._metrics.incr("ingest_queue_full")
+        await queue.put((time.perf_counter(), event))
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, event = await queue.get()
+            self._metrics.observe("ingest_queue", time.perf_counter() - enqueued_at)
+            try:
+                await self._handler(event)
+            except Exception as e:
+                logger.exception(f"处理事件出错: {e}")
+            finally:
+                self.processed += 1
+                queue.task_done()
+
+    async def join(self, timeout: float) -> None:
+        """等待已入队的事件处理完毕，最长 timeout 秒"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self._queues),
+            "queue_depths": [q.qsize() for q in self._queues],
+            "processed": self.processed,
+            "full_waits": self.full_waits,
+        }
+
+
+class _PriorityLane:
+    """提交到事件总线前的优先级通道
+
+    事件总线为每个事件单独起任务执行流水线，队列长度反映不了负载，
+    因此以已提交、但流水线尚未结束的事件数作为积压量。
+    事件对象的 on_done 回调在流水线结束时调用；不支持该回调的事件在对象释放时结束，
+    两者都没有发生的事件超过 inflight_timeout 后不再计入。
+    积压量未达上限时直接提交，否则按优先级排队，积压下降后依次放行；max_inflight 为 0 时不排队。
+    """
+
+    def __init__(
+        self,
+        commit: Callable[[Any], None],
+        max_inflight: int,
+        inflight_timeout: float,
+        metrics: _Metrics,
+    ) -> None:
+        self._commit_fn = commit
+        self._metrics = metrics
+        self.max_inflight = max_inflight
+        self.inflight_timeout = inflight_timeout
+        self._inflight: OrderedDict[int, float] = OrderedDict()
+        self._heap: list[tuple[int, int, Any, float]] = []
+        self._seq = itertools.count()
+        self._pending: Dict[int, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def inflight(self) -> int:
+        # 长时间未释放的事件（如被插件持有）不再计入积压
+        expire_before = time.monotonic() - self.inflight_timeout
+        while self._inflight and next(iter(self._inflight.values())) < expire_before:
+            self._inflight.popitem(last=False)
+        return len(self._inflight)
+
+    def pending(self, priority: int) -> int:
+        return self._pending.get(priority, 0)
+
+    def find_pending(self, predicate: Callable[[Any], bool]) -> Any:
+        for _, _, event, _ in self._heap:
+            if predicate(event):
+                return event
+        return None
+
+    def submit(self, priority: int, event: Any) -> None:
+        if self.max_inflight <= 0 or priority == _PRIORITY_COMMAND or (
+            not self._heap and self.inflight() < self.max_inflight
+        ):
+            self._commit(priority, event, time.perf_counter())
+            return
+        heapq.heappush(self._heap, (priority, next(self._seq), event, time.perf_counter()))
+        self._pending[priority] = self._pending.get(priority, 0) + 1
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = _create_detached_task(self._run())
+
+    def flush(self) -> None:
+        """不再等待，立即提交所有排队中的事件"""
+        while self._heap:
+            self._commit(*self._pop())
+
+    def _pop(self) -> tuple[int, Any, float]:
+        priority, _, event, enqueued_at = heapq.heappop(self._heap)
+        self._pending[priority] -= 1
+        return priority, event, enqueued_at
+
+    def _commit(self, priority: int, event: Any, enqueued_at: float) -> None:
+        if getattr(event, "cancelled", False):
+            return
+        now = time.perf_counter()
+        label = _PRIORITY_NAMES[priority]
+        self._metrics.observe("commit_queue", now - enqueued_at, label)
+        self._metrics.incr("committed", label)
+        # 以序号而非 id(event) 为键，事件释放后 id 可能被新事件复用
+        key = next(self._seq)
+        self._inflight[key] = time.monotonic()
+        if hasattr(event, "on_done"):
+            event.on_done = lambda: self._release(key, now)
+        weakref.finalize(event, self._inflight.pop, key, None)
+        self._commit_fn(event)
+
+    def _release(self, key: int, committed_at: float) -> None:
+        """流水线结束时由事件回调"""
+        if self._inflight.pop(key, None) is None:
+            return
+        self._metrics.observe("pipeline", time.perf_counter() - committed_at)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while self._heap and self.inflight() < self.max_inflight:
+                self._commit(*self._pop())
+            self._wakeup.clear()
+            if self._heap:
+                # 事件结束时会唤醒；对象释放与超时淘汰没有通知，需要定期检查
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), 1)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._wakeup.wait()
+
+
+class _CacheSnapshot:
+    """适配器查询缓存的本地 SQLite 快照，用于重启后预热"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def save(self, entries: list[tuple[str, str, Any, float]]) -> None:
+        """entries 为 (类别, 键, 值, 过期时间) 列表，值需可 JSON 序列化"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (saved_at REAL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value TEXT, expires_at REAL)"
+            )
+            conn.execute("DELETE FROM meta")
+            conn.execute("DELETE FROM entries")
+            conn.execute("INSERT INTO meta VALUES (?)", (time.time(),))
+            conn.executemany(
+                "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                (
+                    (kind, key, json.dumps(value, ensure_ascii=False), expires_at)
+                    for kind, key, value, expires_at in entries
+                ),
+            )
+        conn.close()
+
+    def load(self, max_age: float) -> list[tuple[str, str, Any, float]]:
+        """读取快照；快照整体过旧或条目已过期时丢弃"""
+        if not os.path.exists(self.path):
+            return []
+        conn = sqlite3.connect(self.path)
+        try:
+            row = conn.execute("SELECT saved_at FROM meta").fetchone()
+            now = time.time()
+            if not row or now - row[0] > max_age:
+                return []
+            rows = conn.execute(
+                "SELECT kind, key, value, expires_at FROM entries WHERE expires_at > ?",
+                (now,),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(kind, key, json.loads(value), expires_at) for kind, key, value, expires_at in rows]
+
+
+# 会产生新消息的 OneBot 动作，其返回值中带有 message_id
+_SEND_ACTIONS = frozenset({
+    "send_msg", "send_group_msg", "send_private_msg",
+    "send_group_forward_msg", "send_private_forward_msg",
+})
+# 回复事件时所用的账号。上游的发送调用不带 self_id，由适配器据此补上
+_SEND_ACCOUNT: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "aiocqhttp_send_account", default=None
+)
+# 只读查询类动作，并发的相同请求可以共享同一次调用
+_COALESCE_ACTIONS = frozenset({
+    "get_msg", "get_forward_msg", "get_login_info", "get_stranger_info",
+    "get_group_info", "get_group_member_info", "get_group_member_list",
+    "get_group_file_url", "get_private_file_url",
+})
+
+# 消息转换时经 _lookup 补全信息的查询动作，超时短且经过熔断器，失败时可以降级处理。
+# 插件与适配器其他位置的调用不受影响
+_ENRICH_ACTIONS = frozenset({
+    "get_msg", "get_group_member_info", "get_group_file_url", "get_private_file_url",
+})
+
+# 工作进程上报指标的间隔（秒）
+_WORKER_METRICS_INTERVAL = 5
+# 工作进程启动后在此时间（秒）内退出视为启动失败；连续失败时重启间隔从 5 秒起倍增，达到次数上限后不再重启
+_WORKER_STARTUP_GRACE = 30
+_WORKER_RESTART_LIMIT = 5
+
+# 发送前代替本地媒体文件的占位符前缀，调用发送接口时替换为文件路径或下载地址
+_MEDIA_PLACEHOLDER = "base64://astrbot-media-"
+
+# 缓冲区中非最后一段消息只保留原始事件的这些字段
+_RAW_HEADER_KEYS = (
+    "post_type", "message_type", "sub_type", "message_id",
+    "self_id", "user_id", "group_id", "time",
+)
+
+# 提交优先级，数值越小越优先
+_PRIORITY_COMMAND, _PRIORITY_NOTICE, _PRIORITY_PRIVATE, _PRIORITY_GROUP = range(4)
+_PRIORITY_NAMES = ("command", "notice", "private", "group")
+
+
+class _SingleFlight:
+    """合并并发的相同请求，所有调用方共享同一个进行中的调用"""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            return await asyncio.shield(future)
+        self.coalesced += 1
+        # 返回值可能被调用方修改，合并的调用方各自拿到一份浅拷贝
+        return copy.copy(await asyncio.shield(future))
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced}
+
+
+class _CircuitOpenError(Exception):
+    """熔断期间拒绝的 OneBot API 调用"""
+
+
+class _CircuitBreaker:
+    """连续失败达到阈值后熔断，冷却期结束后放行一次试探调用"""
+
+    def __init__(self, threshold: int, cooldown: float) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trips = 0
+        self.rejected = 0
+        self._probe_at = 0.0
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        # 试探调用的结果迟迟没有回来（如调用方被取消）时，下个冷却期后允许再次试探
+        if now - max(self.opened_at, self._probe_at) >= self.cooldown:
+            self._probe_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.threshold > 0 and self.failures >= self.threshold:
+            if self.opened_at is None:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "open": self.opened_at is not None,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class _TokenBucket:
+    """令牌桶，rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """距离有可用令牌还需等待的时间"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        if self.rate > 0:
+            self._refill(now)
+            self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _SendQueueFull(Exception):
+    """待发送的消息过多"""
+
+
+class _SendScheduler:
+    """发送消息的调度器
+
+    同一目标（群或用户）的消息按调用顺序逐条发送，受目标与账号两级令牌桶限速；
+    不同目标之间并发发送，总并发数与排队数均有上限。
+    """
+
+    # 目标状态超过该数量时清理空闲的条目
+    _PRUNE_THRESHOLD = 1024
+
+    def __init__(
+        self,
+        target_rate: float,
+        target_burst: float,
+        account_rate: float,
+        account_burst: float,
+        max_concurrency: int,
+        max_pending: int,
+        metrics: _Metrics,
+    ) -> None:
+        self._metrics = metrics
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+        self._targets: Dict[Hashable, tuple[asyncio.Lock, _TokenBucket]] = {}
+        self._accounts: Dict[str, _TokenBucket] = {}
+        self._pending = 0
+        self.sent = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+    def _target(self, key: Hashable) -> tuple[asyncio.Lock, _TokenBucket]:
+        state = self._targets.get(key)
+        if state is None:
+            if len(self._targets) >= self._PRUNE_THRESHOLD:
+                self._prune()
+            state = (asyncio.Lock(), _TokenBucket(self.target_rate, self.target_burst))
+            self._targets[key] = state
+        return state
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key, (lock, bucket) in list(self._targets.items()):
+            if not lock.locked() and bucket.full(now):
+                del self._targets[key]
+
+    async def run(self, account: str, target: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise _SendQueueFull(f"待发送的消息超过 {self.max_pending} 条，已丢弃发往 {target} 的消息")
+        enqueued_at = time.monotonic()
+        self._pending += 1
+        try:
+            lock, bucket = self._target((account, target))
+            account_bucket = self._accounts.get(account)
+            if account_bucket is None:
+                account_bucket = self._accounts[account] = _TokenBucket(self.account_rate, self.account_burst)
+            async with lock:
+                throttled = False
+                while True:
+                    now = time.monotonic()
+                    wait = max(bucket.delay(now), account_bucket.delay(now))
+                    if wait <= 0:
+                        break
+                    throttled = True
+                    await asyncio.sleep(wait)
+                bucket.take(now)
+                account_bucket.take(now)
+                self.throttled += throttled
+                async with self._semaphore:
+                    delay = time.monotonic() - enqueued_at
+                    self.sent += 1
+                    self.total_delay += delay
+                    self.max_delay = max(self.max_delay, delay)
+                    self._metrics.observe("send_queue", delay)
+                    return await factory()
+        finally:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending,
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "avg_queue_delay": self.total_delay / self.sent if self.sent else 0.0,
+            "max_queue_delay": self.max_delay,
+        }
+
+
+class _RecentMessage(NamedTuple):
+    """最近消息的快照，用于本地解析引用回复"""
+
+    message_id: str
+    sender_id: str
+    sender_nickname: str
+    timestamp: int
+    message_str: str
+    chain: list
+
+    @classmethod
+    def from_message(cls, abm: AstrBotMessage) -> "_RecentMessage":
+        """嵌套的引用只保留 id，与 get_msg 的解析结果保持一致"""
+        chain = [
+            Reply(id=comp.id) if isinstance(comp, Reply) else comp
+            for comp in abm.message
+        ]
+        return cls(
+            abm.message_id, abm.sender.user_id, abm.sender.nickname,
+            abm.timestamp, abm.message_str, chain,
+        )
+
+    def to_reply(self) -> Reply:
+        return Reply(
+            id=self.message_id, chain=list(self.chain),
+            sender_id=self.sender_id, sender_nickname=self.sender_nickname,
+            time=self.timestamp, message_str=self.message_str,
+            text=self.message_str, qq=self.sender_id
+        )
+
+
+class _LazyFile(File):
+    """文件消息段，下载链接在首次读取文件时才向协议端查询"""
+
+    __slots__ = ("_resolver",)
+
+    def __init__(self, name: str, resolver: Callable[[], Awaitable[dict | None]]) -> None:
+        super().__init__(name=name)
+        object.__setattr__(self, "_resolver", resolver)
+
+    async def resolve_url(self) -> str:
+        """查询并填充下载链接，失败时返回空字符串，下次读取时重试"""
+        resolver = getattr(self, "_resolver", None)
+        if self.url or resolver is None:
+            return self.url
+        try:
+            ret = await resolver()
+        except Exception as e:
+            logger.error(f"获取文件失败: {e}")
+            return ""
+        if not ret or not ret.get("url"):
+            logger.error(f"获取文件失败: {ret}")
+            return ""
+        self.url = ret["url"]
+        if not self.name:
+            self.name = ret.get("file_name", "") or ret.get("name", "")
+        object.__setattr__(self, "_resolver", None)
+        return self.url
+
+    async def get_file(self, allow_return_url: bool = False) -> str:
+        await self.resolve_url()
+        return await super().get_file(allow_return_url)
+
+
+def _local_media_path(component: BaseMessageComponent) -> str | None:
+    """图片、语音消息段指向的本地文件路径，不是本地文件时返回 None"""
+    src = getattr(component, "url", None) or getattr(component, "file", None) or ""
+    if src.startswith("file:///"):
+        src = src[8:]
+    elif "://" in src:
+        return None
+    return src if src and os.path.isfile(src) else None
+
+
+class _MediaCache:
+    """本地图片、语音文件的 base64 编码缓存
+
+    文件按 (路径, 大小, 修改时间) 映射到内容哈希，编码结果以内容哈希为键，
+    内容相同的不同文件共用一份编码；编码总字节数超过上限时淘汰最久未使用的条目。
+    """
+
+    # (路径, 大小, 修改时间) 到内容哈希的映射条数上限
+    _MAX_PATHS = 4096
+
+    def __init__(self, max_bytes: int, max_file_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self._paths: OrderedDict[tuple, str] = OrderedDict()
+        self._payloads: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+        self._single_flight = _SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _read(path: str) -> tuple[str, str]:
+        with open(path, "rb") as f:
+            data = f.read()
+        return hashlib.sha256(data).hexdigest(), base64.b64encode(data).decode()
+
+    async def encode(self, path: str) -> str | None:
+        """返回文件的 base64 编码，文件不存在或超过大小上限时返回 None"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if st.st_size > self.max_file_bytes:
+            return None
+        key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        digest = self._paths.get(key)
+        payload = self._payloads.get(digest) if digest is not None else None
+        if payload is not None:
+            self.hits += 1
+            self._paths.move_to_end(key)
+            self._payloads.move_to_end(digest)
+            return payload
+        self.misses += 1
+        digest, payload = await self._single_flight.do(
+            key, lambda: asyncio.to_thread(self._read, path)
+        )
+        self._paths[key] = digest
+        self._paths.move_to_end(key)
+        while len(self._paths) > self._MAX_PATHS:
+            self._paths.popitem(last=False)
+        if digest not in self._payloads and len(payload) <= self.max_bytes:
+            self._payloads[digest] = payload
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._payloads.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return payload
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._payloads),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class _LocalHttpServer:
+    """只处理 GET 请求的简易 HTTP 服务，文件内容通过 sendfile 发送"""
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+        self._routes: Dict[str, Callable[[str], Awaitable[Any]]] = {}
+        self._server: asyncio.AbstractServer | None = None
+
+    def route(self, prefix: str, handler: Callable[[str], Awaitable[Any]]) -> None:
+        """handler 接收去掉前缀后的路径，返回文件路径、(content_type, bytes) 或 None（404）"""
+        self._routes[prefix] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    @staticmethod
+    def _header(status: int, content_type: str, length: int) -> bytes:
+        reason = {
+            200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+        }.get(status, "")
+        return (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {length}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readline(), 10)
+                while await asyncio.wait_for(reader.readline(), 10) not in (b"\r\n", b"\n", b""):
+                    pass
+            except (ValueError, asyncio.LimitOverrunError, asyncio.IncompleteReadError) as e:
+                # 请求行或请求头超过 StreamReader 的长度上限
+                logger.debug(f"本地 HTTP 请求无效: {e}")
+                writer.write(self._header(400, "text/plain", 0))
+                await writer.drain()
+                return
+            parts = request.decode("latin-1").split()
+            if len(parts) < 2 or parts[0] not in ("GET", "HEAD"):
+                writer.write(self._header(405, "text/plain", 0))
+                return
+            method, path = parts[0], parts[1].split("?", 1)[0]
+            result = None
+            for prefix, handler in self._routes.items():
+                if path.startswith(prefix):
+                    result = await handler(path[len(prefix):])
+                    break
+            if result is None:
+                writer.write(self._header(404, "text/plain", 0))
+            elif isinstance(result, str):
+                with open(result, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    content_type = mimetypes.guess_type(result)[0] or "application/octet-stream"
+                    writer.write(self._header(200, content_type, size))
+                    await writer.drain()
+                    if method == "GET":
+                        await asyncio.get_running_loop().sendfile(writer.transport, f)
+            else:
+                content_type, body = result
+                writer.write(self._header(200, content_type, len(body)))
+                if method == "GET":
+                    writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, OSError) as e:
+            logger.debug(f"本地 HTTP 请求处理失败: {e}")
+        finally:
+            writer.close()
+
+
+class _IpcChannel:
+    """主进程与工作进程之间的消息通道，每条消息为 4 字节长度前缀加数据"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+
+    def send_raw(self, data: bytes) -> None:
+        if self._writer.is_closing():
+            raise ConnectionError("进程间通道已关闭")
+        self._writer.write(len(data).to_bytes(4, "big") + data)
+
+    async def recv_raw(self) -> bytes:
+        size = int.from_bytes(await self._reader.readexactly(4), "big")
+        return await self._reader.readexactly(size)
+
+    def send(self, obj: Any) -> None:
+        self.send_raw(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+    async def recv(self) -> Any:
+        return pickle.loads(await self.recv_raw())
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class _AdapterMessageEvent(AiocqhttpMessageEvent):
+    """由本适配器提交的消息事件
+
+    支持撤销：推测提交的事件被新的分段取代后，流水线在下一阶段停止，且不再发送任何回复。
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.cancelled = False
+        self.sent = False
+        # 首次发送回复前的回调
+        self.on_first_send: Callable[[], None] | None = None
+        # 发送前对消息链中的媒体文件进行预处理
+        self.prepare_chain: Callable[[MessageChain], Awaitable[MessageChain]] | None = None
+        # 流水线结束时的回调
+        self.on_done: Callable[[], None] | None = None
+        self._pipeline_task: asyncio.Task | None = None
+
+    def is_stopped(self) -> bool:
+        # 流水线在每个阶段结束后都会调用此方法，首次调用时记下执行流水线的任务，任务结束即处理完毕
+        if self._pipeline_task is None and self.on_done is not None:
+            task = asyncio.current_task()
+            if task is not None:
+                self._pipeline_task = task
+                task.add_done_callback(self._pipeline_done)
+        return super().is_stopped()
+
+    def _pipeline_done(self, _task: asyncio.Task):
+        if self.on_done is not None:
+            self.on_done()
+            self.on_done = None
+
+    def cancel(self):
+        self.cancelled = True
+        self.stop_event()
+
+    async def send(self, message: MessageChain):
+        if self.cancelled:
+            return
+        if not self.sent:
+            self.sent = True
+            if self.on_first_send:
+                self.on_first_send()
+        if self.prepare_chain is not None:
+            message = await self.prepare_chain(message)
+        token = _SEND_ACCOUNT.set(str(self.message_obj.self_id))
+        try:
+            await super().send(message)
+        finally:
+            _SEND_ACCOUNT.reset(token)
+
+
 @register_platform_adapter(
     "aiocqhttp",
     "适用于 OneBot V11 标准的消息平台适配器，支持反向 WebSockets。",
@@ -60,38 +1173,275 @@ class AiocqhttpAdapter(Platform):
             ),  # 以防旧版本配置不存在
         )
 
+        # 各处理阶段的耗时与计数，通过 get_metrics() 读取，或由 Prometheus 文本接口提供
+        self._metrics = _Metrics(self.config.get("metrics_enable", True))
+        self._metrics_server: _LocalHttpServer | None = None
+        if self.config.get("metrics_http_enable", False):
+            self._metrics_server = _LocalHttpServer(
+                self.config.get("metrics_http_host", "127.0.0.1"),
+                self.config.get("metrics_http_port", 6197),
+            )
+            self._metrics_server.route("/metrics", self._serve_metrics)
+        # 多进程模式下各工作进程最近上报的指标
+        self._worker_metrics: Dict[int, dict] = {}
+
         # --- 消息分段聚合相关配置 ---
         self.user_message_buffers: Dict[str, Dict[str, Any]] = {}
         # 用户发送分段消息的等待时间（秒）
         self.segment_wait_time: float = self.config.get("segment_input_wait_sec", 10)
+        # 单个缓冲区的分段数与总字数上限，超出时提前处理
+        self.segment_max_fragments: int = self.config.get("segment_max_fragments", 20)
+        self.segment_max_chars: int = self.config.get("segment_max_chars", 4000)
+        # 同时缓冲的会话数上限，超出时先处理最早的缓冲区
+        self.segment_max_buffers: int = self.config.get("segment_max_buffers", 1000)
+        self._segment_early_flushes = 0
+        # 推测提交：输入停顿 segment_speculative_idle_sec 后先行提交，回复发出前若有新分段则撤销重来
+        self.segment_speculative_enable: bool = self.config.get("segment_speculative_enable", False)
+        self.segment_speculative_idle_sec: float = self.config.get("segment_speculative_idle_sec", 1.5)
+        self._speculative_scheduler = _DeadlineScheduler(self._dispatch_speculative)
+        self._speculative_cancelled = 0
+        # 关闭适配器或连接重建时，立即处理缓冲中的消息，最长等待 segment_drain_timeout_sec
+        self.segment_drain_timeout_sec: float = self.config.get("segment_drain_timeout_sec", 5)
+        self._segment_drained = 0
+        self._ws_connected_once = False
+        # 群聊中按 (群, 发送者) 分别聚合，互不阻塞，无需强制开启独立会话
+        self.segment_group_per_sender: bool = self.config.get("segment_group_per_sender", True)
+        # fixed: 固定等待 segment_wait_time；adaptive: 按会话学习的分段间隔动态调整
+        self.segment_wait_mode: str = self.config.get("segment_wait_mode", "fixed")
+        self._adaptive_wait = _AdaptiveWait(
+            default=self.segment_wait_time,
+            multiplier=self.config.get("segment_adaptive_multiplier", 2.5),
+            min_wait=self.config.get("segment_adaptive_min_sec", 2),
+            max_wait=self.config.get("segment_adaptive_max_sec", 20),
+            alpha=self.config.get("segment_adaptive_alpha", 0.3),
+            maxsize=self.config.get("segment_adaptive_max_sessions", 5000),
+        )
+        # 输入结束判断：命中规则时立即处理或缩短等待
+        self.segment_eou_enable: bool = self.config.get("segment_eou_enable", False)
+        self.eou_detector = self._build_eou_detector()
+        # “对方正在输入”通知：输入中延长等待，停止输入后尽快处理；此类通知不提交到流水线
+        self.segment_typing_enable: bool = self.config.get("segment_typing_enable", True)
+        self.segment_typing_extend_sec: float = self.config.get("segment_typing_extend_sec", 5)
+        self.segment_typing_stop_wait_sec: float = self.config.get("segment_typing_stop_wait_sec", 0.5)
+        # 从缓冲区建立起算，输入状态最多将合并等待延长到该时长，避免持续的输入通知一直占住缓冲区
+        self.segment_typing_max_wait_sec: float = self.config.get("segment_typing_max_wait_sec", 30)
+        self._typing_notices = 0
+        # 所有会话共用一个调度器，到期后批量处理
+        self._segment_scheduler = _DeadlineScheduler(self._flush_expired_sessions)
+
+        # --- 远程查询缓存 ---
+        # 群成员信息缓存，键为 (group_id, user_id)，群名片变更/退群通知时失效
+        self._member_cache = _TTLCache(
+            maxsize=self.config.get("member_cache_size", 2048),
+            ttl=self.config.get("member_cache_ttl_sec", 600),
+        )
+        # 群成员名单索引，连接建立或群内首次收到事件时整体拉取，之后由群成员变动通知增量维护
+        self.roster_prefetch_enable: bool = self.config.get("roster_prefetch_enable", True)
+        self.roster_prefetch_groups: list = self.config.get("roster_prefetch_groups", [])
+        self.roster_refresh_sec: float = self.config.get("roster_refresh_sec", 3600)
+        self.roster_max_groups: int = self.config.get("roster_max_groups", 200)
+        # 同时拉取的名单数上限，避免连接建立时集中拉取
+        self._roster_semaphore = asyncio.Semaphore(self.config.get("roster_load_concurrency", 2))
+        # 按最近访问排序，达到上限后新群不再加载名单，改为逐个查询成员信息
+        self._group_rosters: OrderedDict[str, Dict[str, dict]] = OrderedDict()
+        self._roster_loaded_at: Dict[str, float] = {}
+        self._roster_loading: set[str] = set()
+        # 各群名单由哪个账号拉取，重连时只刷新该账号所在的群
+        self._roster_accounts: Dict[str, str] = {}
+        # 本次运行中已连接过的账号，再次连接即为重连
+        self._connected_accounts: set[str] = set()
+        # 最近收发的消息，键为 (self_id, message_id)，引用回复命中时无需再调用 get_msg。
+        # message_id 由各协议端实例各自分配，不同账号之间可能重复
+        self._recent_messages = _TTLCache(
+            maxsize=self.config.get("recent_message_cache_size", 2000),
+            ttl=self.config.get("recent_message_cache_ttl_sec", 3600),
+        )
+        # 文件消息段的下载链接延迟到插件或模型读取文件时才查询；
+        # 关闭后在解析消息时立即查询，供直接读取 File.url 的插件使用
+        self.file_lazy_resolve: bool = self.config.get("file_lazy_resolve", True)
+        # 文件下载链接缓存，键为 (self_id, group_id, file_id)
+        self._file_urls = _TTLCache(
+            maxsize=self.config.get("file_url_cache_size", 256),
+            ttl=self.config.get("file_url_cache_ttl_sec", 600),
+        )
+        # 解析单条消息时，每个连接同时进行的远程查询数上限
+        self.lookup_concurrency: int = self.config.get("lookup_concurrency", 8)
+        self._lookup_semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 查询缓存的本地快照，关闭时及定期写入，启动时读取以预热
+        self.cache_snapshot_enable: bool = self.config.get("cache_snapshot_enable", False)
+        self.cache_snapshot_interval_sec: float = self.config.get("cache_snapshot_interval_sec", 300)
+        self.cache_snapshot_max_age_sec: float = self.config.get("cache_snapshot_max_age_sec", 86400)
+        self._snapshot = _CacheSnapshot(
+            self.config.get("cache_snapshot_path")
+            or os.path.join("data", f"aiocqhttp_cache_{self.metadata.id}.db")
+        )
+        # 已处理过的 (self_id, message_id)，用于丢弃协议端重连或重试时重复投递的消息
+        self._seen_messages = _TTLCache(
+            maxsize=self.config.get("dedup_cache_size", 10000),
+            ttl=self.config.get("dedup_window_sec", 300),
+        )
+        # 事件按会话分片交给 ingest_workers 个工作协程处理，0 表示在回调中直接处理
+        ingest_workers: int = self.config.get("ingest_workers", 4)
+        self._workers = (
+            _ShardedWorkers(
+                ingest_workers,
+                self.config.get("ingest_queue_size", 256),
+                self._process_event,
+                self._metrics,
+            )
+            if ingest_workers > 0
+            else None
+        )
+        # 提交前的优先级通道：指令直接提交，通知优先于私聊，私聊优先于群聊。
+        # 流水线耗时包含 LLM 调用与插件等待，默认不限制，按部署情况开启
+        self._lane = _PriorityLane(
+            self.commit_event,
+            max_inflight=self.config.get("commit_max_inflight", 0),
+            inflight_timeout=self.config.get("commit_inflight_timeout_sec", 120),
+            metrics=self._metrics,
+        )
+        # 排队的群聊消息达到阈值后的处理策略：none / drop 丢弃 / merge 合并到同一发送者排队中的消息 / busy 回复繁忙
+        self.commit_shed_policy: str = self.config.get("commit_shed_policy", "none")
+        self.commit_shed_threshold: int = self.config.get("commit_shed_threshold", 50)
+        self.commit_shed_busy_text: str = self.config.get("commit_shed_busy_text", "当前消息较多，请稍后再试。")
+        self._shed_events = 0
+        # 通知事件过滤表，条目为 "notice_type" 或 "notice_type.sub_type"
+        self._notice_allow = frozenset(self.config.get("notice_allow", []))
+        self._notice_deny = frozenset(self.config.get("notice_deny", []))
+        # 时间窗口内相同的通知（类型、子类型、群、用户、目标均相同）只处理首个，其余在窗口结束时合并为一个事件。
+        # 只合并 notice_coalesce_types 中的类型；带 message_id 或文件的通知各不相同，不会合并
+        self.notice_coalesce_window_sec: float = self.config.get("notice_coalesce_window_sec", 3)
+        self._notice_coalesce_types = frozenset(self.config.get("notice_coalesce_types", ["notify.poke"]))
+        self._notice_windows: Dict[str, Dict[str, Any]] = {}
+        self._notice_scheduler = _DeadlineScheduler(self._flush_notice_windows)
+        self._notices_filtered = 0
+        self._notices_coalesced = 0
+        # 各账号的登录信息，键为 self_id，用于记录自身发出的消息
+        self._login_infos: Dict[str, dict] = {}
+        self._background_tasks: set[asyncio.Task] = set()
+        # 合并并发的相同查询请求
+        self._single_flight = _SingleFlight()
+        # 发送本地图片、语音时复用已编码的 base64 数据，按编码后的总字节数淘汰
+        self._media_cache = _MediaCache(
+            max_bytes=int(self.config.get("media_cache_size_mb", 64) * 1024 * 1024),
+            max_file_bytes=int(self.config.get("media_cache_max_file_mb", 16) * 1024 * 1024),
+        ) if self.config.get("media_cache_enable", True) else None
+        # 较大的本地媒体文件不再以 base64 内联到 WebSocket 消息中：
+        # file 模式直接传递本地路径（协议端与 AstrBot 在同一主机时），http 模式由内置 HTTP 服务提供下载
+        self.media_serve_mode: str = self.config.get("media_serve_mode", "base64")
+        self.media_serve_threshold: int = int(self.config.get("media_serve_threshold_kb", 256) * 1024)
+        self.media_serve_token_ttl_sec: float = self.config.get("media_serve_token_ttl_sec", 300)
+        self.media_serve_url: str = self.config.get("media_serve_url", "")
+        # 令牌到 (文件路径, 过期时间) 的映射
+        self._media_tokens: Dict[str, tuple[str, float]] = {}
+        self._media_server: _LocalHttpServer | None = None
+        if self.media_serve_mode == "http":
+            self._media_server = _LocalHttpServer(
+                self.config.get("media_serve_host", "127.0.0.1"),
+                self.config.get("media_serve_port", 6198),
+            )
+            self._media_server.route("/media/", self._serve_media)
+        # 发送消息限速：同一群/用户与同一账号各有一个令牌桶，同一目标按顺序发送，不同目标并发发送
+        self.send_rate_limit_enable: bool = self.config.get("send_rate_limit_enable", True)
+        self._send_scheduler = _SendScheduler(
+            target_rate=self.config.get("send_target_rate", 1),
+            target_burst=self.config.get("send_target_burst", 5),
+            account_rate=self.config.get("send_account_rate", 5),
+            account_burst=self.config.get("send_account_burst", 20),
+            max_concurrency=self.config.get("send_max_concurrency", 8),
+            max_pending=self.config.get("send_queue_size", 1000),
+            metrics=self._metrics,
+        )
+        # 会话 ("group"/"private", id) 最近收到消息的账号
+        self._session_accounts: OrderedDict[tuple[str, str], str] = OrderedDict()
+        # OneBot API 单次调用超时：消息转换中的补全查询较短，发送类动作较长，其余沿用 CQHttp 的 api_timeout_sec
+        self.api_enrich_timeout_sec: float = self.config.get("api_enrich_timeout_sec", 5)
+        self.api_send_timeout_sec: float = self.config.get("api_send_timeout_sec", 60)
+        self.api_timeouts: Dict[str, float] = {
+            "get_group_member_list": 30,
+            **self.config.get("api_timeouts", {}),
+        }
+        # 消息转换中的补全查询连续失败或超时达到阈值后熔断，冷却期内跳过补全，消息按降级方式转换
+        self._breaker = _CircuitBreaker(
+            self.config.get("api_breaker_threshold", 5),
+            self.config.get("api_breaker_cooldown_sec", 30),
+        )
+        self._api_timeouts = 0
+
+        # 多进程模式：由 worker_processes 个工作进程分别监听 port ~ port+N-1，负责连接、消息解析与分段聚合，
+        # 解析后的消息经进程间通道交给本进程提交，本进程中的 API 调用按账号与会话转发给对应的工作进程
+        self.worker_processes: int = self.config.get("worker_processes", 0)
+        # 工作进程中连接主进程的通道，主进程中为 None
+        self._ipc: _IpcChannel | None = None
+        self._ipc_authkey = uuid.uuid4().hex
+        self._worker_channels: Dict[int, _IpcChannel] = {}
+        self._worker_procs: Dict[int, Any] = {}
+        # self_id 与 ("group"/"private", id) 到工作进程编号的映射
+        self._account_workers: Dict[str, int] = {}
+        self._session_workers: OrderedDict[tuple[str, str], int] = OrderedDict()
+        self._remote_calls: Dict[int, tuple[int, asyncio.Future]] = {}
+        self._remote_call_ids = itertools.count()
+        self._workers_stopping = False
+
+        # 截获所有 OneBot API 调用（包括 bot.send 与插件中的调用）
+        self._bot_call_action = self.bot.call_action
+        self.bot.call_action = self._call_action
+        if self.worker_processes > 0:
+            self._bot_call_action = self._call_worker
 
         @self.bot.on_request()
         async def request(event: Event):
-            abm = await self.convert_message(event)
-            if abm:
-                await self.handle_msg(abm)
+            await self._ingest(event)
 
         @self.bot.on_notice()
         async def notice(event: Event):
-            abm = await self.convert_message(event)
-            if abm:
-                await self.handle_msg(abm)
+            if self._is_input_status(event):
+                # 与私聊消息进入同一分片，在用户刚发出的分段入缓冲区之后再处理
+                await self._ingest(event)
+                return
+            # 成员缓存与名单的维护不受通知过滤与合并影响
+            if event.get("notice_type") in ("group_card", "group_increase", "group_decrease"):
+                self._apply_member_notice(event)
+            if not self._notice_allowed(event) or self._coalesce_notice(event):
+                return
+            await self._ingest(event)
 
         @self.bot.on_message("group")
         async def group(event: Event):
-            abm = await self.convert_message(event)
-            if abm:
-                await self.handle_msg(abm)
+            if self._is_duplicate(event):
+                return
+            await self._ingest(event)
 
         @self.bot.on_message("private")
         async def private(event: Event):
-            abm = await self.convert_message(event)
-            if abm:
-                await self.handle_msg(abm)
+            if self._is_duplicate(event):
+                return
+            await self._ingest(event)
 
         @self.bot.on_websocket_connection
-        def on_websocket_connection(_):
+        async def on_websocket_connection(event):
             logger.info("aiocqhttp(OneBot v11) 适配器已连接。")
+            self_id = getattr(event, "self_id", None)
+            self_id = None if self_id is None else str(self_id)
+            self._create_background_task(self._fetch_login_info(self_id))
+            if self._ipc is not None and self_id is not None:
+                self._ipc.send(("online", self_id))
+            if self._ws_connected_once and self.user_message_buffers:
+                self._create_background_task(self._drain_buffers("连接已重建", self_id))
+            self._ws_connected_once = True
+            reconnected = self_id in self._connected_accounts
+            if self_id is not None:
+                self._connected_accounts.add(self_id)
+            if self.roster_prefetch_enable:
+                # 刷新该账号已加载且已过期的群，并预加载配置中指定的群；拉取并发受 roster_load_concurrency 限制。
+                # 重连期间可能错过成员变动通知，该账号拉取的名单即使未过期也重新拉取
+                groups = {
+                    *(g for g in self._group_rosters if self._roster_accounts.get(g, self_id) == self_id),
+                    *map(str, self.roster_prefetch_groups),
+                }
+                for group_id in groups:
+                    force = reconnected and self._roster_accounts.get(group_id) == self_id
+                    self._ensure_group_roster(group_id, self_id, force=force)
 
     async def send_by_session(
         self,
@@ -105,15 +1455,92 @@ class AiocqhttpAdapter(Platform):
             session_id = session.session_id
         await AiocqhttpMessageEvent.send_message(
             bot=self.bot,
-            message_chain=message_chain,
+            message_chain=await self._prepare_media_chain(message_chain),
             event=None,  # 这里不需要 event，因为是通过 session 发送的
             is_group=is_group,
             session_id=session_id,
         )
         await super().send_by_session(session, message_chain)
 
+    async def _ingest(self, event: Event):
+        if self._workers is None:
+            await self._process_event(event)
+            return
+        if event.get("group_id"):
+            shard_key = f"group_{event.group_id}"
+        else:
+            shard_key = f"user_{event.user_id}"
+        await self._workers.submit(shard_key, event)
+
+    async def _process_event(self, event: Event):
+        if self._is_input_status(event):
+            self._handle_input_status(event)
+            return
+        started_at = time.perf_counter()
+        post_type = event.get("post_type", "")
+        abm = await self.convert_message(event)
+        self._metrics.observe("convert", time.perf_counter() - started_at, post_type)
+        self._metrics.incr("events", post_type)
+        if abm:
+            await self.handle_msg(abm)
+
+    @staticmethod
+    def _notice_matches(event: Event, types: frozenset) -> bool:
+        """通知是否属于 types 中的类型，条目为 notice_type 或 notice_type.sub_type"""
+        notice_type = event.get("notice_type", "")
+        return notice_type in types or f"{notice_type}.{event.get('sub_type', '')}" in types
+
+    def _notice_allowed(self, event: Event) -> bool:
+        if self._notice_matches(event, self._notice_deny) or (
+            self._notice_allow and not self._notice_matches(event, self._notice_allow)
+        ):
+            self._notices_filtered += 1
+            return False
+        return True
+
+    def _coalesce_notice(self, event: Event) -> bool:
+        """返回 True 表示该通知已并入时间窗口，暂不处理"""
+        if self.notice_coalesce_window_sec <= 0 or not self._notice_matches(event, self._notice_coalesce_types):
+            return False
+        file = event.get("file")
+        file_id = file.get("id", "") if isinstance(file, dict) else ""
+        key = "|".join(str(event.get(k, "")) for k in (
+            "self_id", "notice_type", "sub_type", "group_id", "user_id", "target_id", "message_id"
+        )) + f"|{file_id}"
+        window = self._notice_windows.get(key)
+        if window is None:
+            self._notice_windows[key] = {"count": 0, "event": None}
+            self._notice_scheduler.schedule(key, self.notice_coalesce_window_sec)
+            return False
+        window["count"] += 1
+        window["event"] = event
+        self._notices_coalesced += 1
+        return True
+
+    async def _flush_notice_windows(self, keys: list[str]):
+        for key in keys:
+            window = self._notice_windows.pop(key, None)
+            if window and window["count"]:
+                # coalesced_count 为合并进该事件的通知数量
+                event = window["event"]
+                event["coalesced_count"] = window["count"]
+                await self._ingest(event)
+
+    def _is_duplicate(self, event: Event) -> bool:
+        """同一条消息在去重时间窗口内再次到达时返回 True"""
+        if event.message_id is None:
+            return False
+        key = (str(event.self_id), str(event.message_id))
+        if self._seen_messages.get(key) is not None:
+            logger.debug(f"[aiocqhttp] 丢弃重复投递的消息 {key}")
+            return True
+        self._seen_messages.set(key, True)
+        return False
+
     async def convert_message(self, event: Event) -> AstrBotMessage | None:
-        logger.debug(f"[aiocqhttp] RawMessage {event}")
+        # 原始事件可能很大，仅在开启调试日志时格式化
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[aiocqhttp] RawMessage {event}")
 
         if event["post_type"] == "message":
             abm = await self._convert_handle_message_event(event)
@@ -202,6 +1629,7 @@ class AiocqhttpAdapter(Platform):
             abm.group_id = str(event.group_id)
             abm.group = Group(str(event.group_id))
             abm.group.group_name = event.get("group_name", "N/A")
+            self._ensure_group_roster(abm.group_id, abm.self_id)
         elif event["message_type"] == "private":
             abm.type = MessageType.FRIEND_MESSAGE
         
@@ -224,101 +1652,506 @@ class AiocqhttpAdapter(Platform):
                 logger.error(f"回复消息失败: {e}")
             raise ValueError(err)
 
+        # 第一阶段：按原顺序切分消息段，需要远程查询的部分先收集为协程
+        parts: list = []
         for t, m_group in itertools.groupby(event.message, key=lambda x: x["type"]):
+            segments = list(m_group)
             if t == "text":
-                current_text = "".join(m["data"]["text"] for m in m_group).strip()
-                if not current_text:
-                    continue
-                message_str += current_text
-                abm.message.append(ComponentTypes[t](text=current_text))
-
+                current_text = "".join(m["data"]["text"] for m in segments).strip()
+                if current_text:
+                    parts.append(([ComponentTypes[t](text=current_text)], current_text))
             elif t == "file":
-                for m in m_group:
-                    if m["data"].get("url") and m["data"].get("url").startswith("http"):
-                        file_name = m["data"].get("file_name", "") or m["data"].get("name", "") or m["data"].get("file", "") or "file"
-                        abm.message.append(File(name=file_name, url=m["data"]["url"]))
-                    else:
-                        try:
-                            ret = None
-                            if abm.type == MessageType.GROUP_MESSAGE:
-                                ret = await self.bot.call_action(
-                                    action="get_group_file_url",
-                                    file_id=event.message[0]["data"]["file_id"],
-                                    group_id=event.group_id,
-                                )
-                            elif abm.type == MessageType.FRIEND_MESSAGE:
-                                ret = await self.bot.call_action(
-                                    action="get_private_file_url",
-                                    file_id=event.message[0]["data"]["file_id"],
-                                )
-                            if ret and "url" in ret:
-                                file_url = ret["url"]
-                                file_name = ret.get("file_name", "") or ret.get("name", "") or m["data"].get("file", "") or m["data"].get("file_name", "")
-                                abm.message.append(File(name=file_name, url=file_url))
-                            else:
-                                logger.error(f"获取文件失败: {ret}")
-                        except Exception as e:
-                            logger.error(f"获取文件失败: {e}")
-
+                parts.append(self._convert_file_segments(event, abm.type, segments))
             elif t == "reply":
-                for m in m_group:
-                    if not get_reply:
-                        abm.message.append(ComponentTypes[t](**m["data"]))
-                    else:
-                        try:
-                            reply_event_data = await self.bot.call_action(action="get_msg", message_id=int(m["data"]["id"]))
-                            reply_event_data["post_type"] = "message"
-                            new_event = Event.from_payload(reply_event_data)
-                            if not new_event: continue
-                            abm_reply = await self._convert_handle_message_event(new_event, get_reply=False)
-                            abm.message.append(Reply(
-                                id=abm_reply.message_id, chain=abm_reply.message,
-                                sender_id=abm_reply.sender.user_id, sender_nickname=abm_reply.sender.nickname,
-                                time=abm_reply.timestamp, message_str=abm_reply.message_str,
-                                text=abm_reply.message_str, qq=abm_reply.sender.user_id
-                            ))
-                        except Exception as e:
-                            logger.error(f"获取引用消息失败: {e}")
-                            abm.message.append(ComponentTypes[t](**m["data"]))
+                parts.append(self._convert_reply_segments(abm.self_id, segments, get_reply))
             elif t == "at":
-                first_at_self_processed = False
-                at_parts = []
-                for m in m_group:
-                    try:
-                        if m["data"]["qq"] == "all":
-                            abm.message.append(At(qq="all", name="全体成员"))
-                            continue
-                        at_info = await self.bot.call_action(action="get_group_member_info", group_id=event.group_id, user_id=int(m["data"]["qq"]), no_cache=False)
-                        if at_info:
-                            nickname = at_info.get("card", "") or at_info.get("nick", "") or at_info.get("nickname", "")
-                            is_at_self = str(m["data"]["qq"]) in {abm.self_id, "all"}
-                            abm.message.append(At(qq=m["data"]["qq"], name=nickname))
-                            if is_at_self and not first_at_self_processed:
-                                first_at_self_processed = True
-                            else:
-                                at_parts.append(f" @{nickname}({m['data']['qq']}) ")
-                        else:
-                            abm.message.append(At(qq=str(m["data"]["qq"]), name=""))
-                    except Exception as e:
-                        logger.error(f"获取 @ 用户信息失败: {e}")
-                message_str += "".join(at_parts)
+                parts.append(self._convert_at_segments(event, abm.self_id, segments))
             elif t == "markdown":
-                text = m["data"].get("markdown") or m["data"].get("content", "")
-                abm.message.append(Plain(text=text))
-                message_str += text
+                for m in segments:
+                    text = m["data"].get("markdown") or m["data"].get("content", "")
+                    parts.append(([Plain(text=text)], text))
             else:
-                for m in m_group:
+                components = []
+                for m in segments:
                     try:
                         if t not in ComponentTypes: continue
-                        abm.message.append(ComponentTypes[t](**m["data"]))
+                        components.append(ComponentTypes[t](**m["data"]))
                     except Exception as e:
                         logger.exception(f"消息段解析失败: {e}")
+                parts.append((components, ""))
+
+        # 第二阶段：并发执行所有远程查询，再按原顺序拼装
+        pending = [i for i, part in enumerate(parts) if not isinstance(part, tuple)]
+        if pending:
+            results = await asyncio.gather(*(parts[i] for i in pending))
+            for i, result in zip(pending, results):
+                parts[i] = result
+        for components, text in parts:
+            abm.message.extend(components)
+            message_str += text
 
         abm.timestamp = int(time.time())
         abm.message_str = message_str
         abm.raw_message = event
+        self._remember_message(abm)
         return abm
 
+    async def _convert_file_segments(
+        self, event: Event, message_type: MessageType, segments: list
+    ) -> tuple[list, str]:
+        self_id = str(event.self_id)
+        group_id = event.group_id if message_type == MessageType.GROUP_MESSAGE else None
+
+        async def convert(m: dict) -> File | None:
+            if m["data"].get("url") and m["data"].get("url").startswith("http"):
+                file_name = m["data"].get("file_name", "") or m["data"].get("name", "") or m["data"].get("file", "") or "file"
+                return File(name=file_name, url=m["data"]["url"])
+            file_id = m["data"].get("file_id")
+            if not file_id or message_type not in (MessageType.GROUP_MESSAGE, MessageType.FRIEND_MESSAGE):
+                logger.error(f"获取文件失败: {m['data']}")
+                return None
+            file_name = m["data"].get("file", "") or m["data"].get("file_name", "") or m["data"].get("name", "")
+            resolver = lambda: self._resolve_file_url(self_id, group_id, file_id)
+            if self.file_lazy_resolve:
+                return _LazyFile(name=file_name, resolver=resolver)
+            try:
+                ret = await resolver()
+                if ret and "url" in ret:
+                    file_name = ret.get("file_name", "") or ret.get("name", "") or file_name
+                    return File(name=file_name, url=ret["url"])
+                logger.error(f"获取文件失败: {ret}")
+            except Exception as e:
+                logger.error(f"获取文件失败: {e}")
+            return None
+
+        files = await asyncio.gather(*(convert(m) for m in segments))
+        return [f for f in files if f is not None], ""
+
+    async def _resolve_file_url(self, self_id: str, group_id: Any, file_id: str) -> dict | None:
+        """查询文件下载链接，群文件与私聊文件分别调用不同的接口"""
+        key = (self_id, str(group_id), file_id)
+        cached = self._file_urls.get(key)
+        if cached is not None:
+            return cached
+        if group_id is not None:
+            ret = await self._lookup(self_id, "get_group_file_url", file_id=file_id, group_id=group_id)
+        else:
+            ret = await self._lookup(self_id, "get_private_file_url", file_id=file_id)
+        if ret and ret.get("url"):
+            self._file_urls.set(key, ret)
+        return ret
+
+    async def _convert_reply_segments(
+        self, self_id: str, segments: list, get_reply: bool
+    ) -> tuple[list, str]:
+        if not get_reply:
+            return [ComponentTypes["reply"](**m["data"]) for m in segments], ""
+        replies = await asyncio.gather(*(self._resolve_reply(self_id, m) for m in segments))
+        return [r for r in replies if r is not None], ""
+
+    async def _resolve_reply(self, self_id: str, m: dict) -> Reply | None:
+        cached = self._recent_messages.get((str(self_id), str(m["data"]["id"])))
+        if cached:
+            return cached.to_reply()
+        try:
+            reply_event_data = await self._lookup(self_id, "get_msg", message_id=int(m["data"]["id"]))
+            reply_event_data = {**reply_event_data, "post_type": "message"}
+            new_event = Event.from_payload(reply_event_data)
+            if not new_event: return None
+            abm_reply = await self._convert_handle_message_event(new_event, get_reply=False)
+            return _RecentMessage.from_message(abm_reply).to_reply()
+        except _CircuitOpenError as e:
+            logger.debug(f"获取引用消息失败: {e}")
+            return ComponentTypes["reply"](**m["data"])
+        except Exception as e:
+            logger.error(f"获取引用消息失败: {e}")
+            return ComponentTypes["reply"](**m["data"])
+
+    async def _convert_at_segments(
+        self, event: Event, self_id: str, segments: list
+    ) -> tuple[list, str]:
+        async def lookup(qq: str) -> dict | None:
+            if qq == "all":
+                return None
+            return await self._get_group_member_info(self_id, event.group_id, qq)
+
+        infos = await asyncio.gather(
+            *(lookup(m["data"]["qq"]) for m in segments), return_exceptions=True
+        )
+        components = []
+        first_at_self_processed = False
+        at_parts = []
+        for m, at_info in zip(segments, infos):
+            if m["data"]["qq"] == "all":
+                components.append(At(qq="all", name="全体成员"))
+                continue
+            if isinstance(at_info, Exception):
+                # 查询失败时保留 @ 本身，只是缺少昵称
+                if isinstance(at_info, _CircuitOpenError):
+                    logger.debug(f"获取 @ 用户信息失败: {at_info}")
+                else:
+                    logger.error(f"获取 @ 用户信息失败: {at_info}")
+                components.append(At(qq=str(m["data"]["qq"]), name=""))
+                continue
+            if at_info:
+                nickname = at_info.get("card", "") or at_info.get("nick", "") or at_info.get("nickname", "")
+                is_at_self = str(m["data"]["qq"]) in {self_id, "all"}
+                components.append(At(qq=m["data"]["qq"], name=nickname))
+                if is_at_self and not first_at_self_processed:
+                    first_at_self_processed = True
+                else:
+                    at_parts.append(f" @{nickname}({m['data']['qq']}) ")
+            else:
+                components.append(At(qq=str(m["data"]["qq"]), name=""))
+        return components, "".join(at_parts)
+
+    # --- 最近消息记录 ---
+
+    def _remember_message(self, abm: AstrBotMessage):
+        """记录收到的消息"""
+        self._recent_messages.set(
+            (str(abm.self_id), str(abm.message_id)), _RecentMessage.from_message(abm)
+        )
+
+    def _remember_sent_message(self, message_id: Any, message: Any, self_id: Any = None):
+        """记录自身发出的消息。媒体段可能是 base64 数据，不保留"""
+        if isinstance(message, str):
+            message = [{"type": "text", "data": {"text": message}}]
+        if not isinstance(message, list):
+            return
+        chain = []
+        message_str = ""
+        for seg in message:
+            t, data = seg.get("type"), seg.get("data") or {}
+            if t == "text":
+                chain.append(Plain(text=data.get("text", "")))
+                message_str += data.get("text", "")
+            elif t in ("image", "record", "video", "file") or t not in ComponentTypes:
+                continue
+            else:
+                try:
+                    chain.append(ComponentTypes[t](**data))
+                except Exception:
+                    continue
+        if self_id is not None:
+            info = self._login_infos.get(str(self_id), {})
+        elif len(self._login_infos) == 1:
+            # 未指明账号时，只有一个账号在线才能确定发送者
+            info = next(iter(self._login_infos.values()))
+        else:
+            info = {}
+        self_id = str(self_id if self_id is not None else info.get("user_id", ""))
+        self._recent_messages.set((self_id, str(message_id)), _RecentMessage(
+            str(message_id), self_id, info.get("nickname", self_id),
+            int(time.time()), message_str.strip(), chain,
+        ))
+
+    async def _lookup(self, self_id: str, action: str, **params) -> Any:
+        """消息解析阶段的远程查询，受单个连接的并发上限约束；补全查询使用较短的超时并经过熔断器"""
+        guarded = action in _ENRICH_ACTIONS
+        if guarded and not self._breaker.allow():
+            raise _CircuitOpenError(f"OneBot API {action} 已熔断，跳过调用")
+        semaphore = self._lookup_semaphores.get(self_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.lookup_concurrency)
+            self._lookup_semaphores[self_id] = semaphore
+        timeout = self.api_timeouts.get(action, self.api_enrich_timeout_sec) if guarded else None
+        async with semaphore:
+            try:
+                ret = await asyncio.wait_for(self._account_call(self_id, action, **params), timeout)
+            except asyncio.TimeoutError:
+                if not guarded:
+                    raise
+                self._metrics.incr("api_timeouts", action)
+                self._api_timeouts += 1
+                self._breaker.record_failure()
+                raise asyncio.TimeoutError(f"OneBot API {action} 超过 {timeout} 秒未响应") from None
+            except ActionFailed:
+                # 协议端正常返回了错误（如消息不存在），说明连接本身是健康的
+                if guarded:
+                    self._breaker.record_success()
+                raise
+            except Exception:
+                if guarded:
+                    self._breaker.record_failure()
+                raise
+        if guarded:
+            self._breaker.record_success()
+        return ret
+
+    async def _account_call(self, self_id: str | None, action: str, **params) -> Any:
+        """通过指定账号的连接调用 API。
+
+        不带 self_id 的调用由 aiocqhttp 按当前上下文中的 WebSocket 连接发送，
+        在后台任务中可能落到其他账号的连接上，因此查询类调用都显式指定账号。
+        """
+        if self_id:
+            params["self_id"] = int(self_id) if str(self_id).isdigit() else self_id
+        return await self.bot.call_action(action=action, **params)
+
+    async def _fetch_login_info(self, self_id: str | None):
+        try:
+            if self_id is None:
+                info = await self.bot.call_action(action="get_login_info") or {}
+            else:
+                info = await self.bot.call_action(action="get_login_info", self_id=self_id) or {}
+        except Exception as e:
+            logger.warning(f"获取登录账号信息失败: {e}")
+            return
+        self._login_infos[str(info.get("user_id") or self_id)] = info
+
+    # --- OneBot API 调用 ---
+
+    async def _call_action(self, action: str, **params) -> Any:
+        """所有 OneBot API 调用的统一入口"""
+        if action in _COALESCE_ACTIONS:
+            key = (action, tuple(sorted((k, repr(v)) for k, v in params.items())))
+            return await self._single_flight.do(
+                key, lambda: self._guarded_call(action, params)
+            )
+        if self._media_tokens and isinstance(params.get("message"), list):
+            params["message"] = self._fill_media_placeholders(params["message"])
+        if action in _SEND_ACTIONS and params.get("self_id") is None:
+            # 指明账号，使多账号时按账号限速，且经该账号自己的连接发出
+            self_id = _SEND_ACCOUNT.get() or self._session_accounts.get(self._send_target(action, params))
+            if self_id:
+                params["self_id"] = int(self_id) if self_id.isdigit() else self_id
+        if action in _SEND_ACTIONS and self.send_rate_limit_enable:
+            ret = await self._send_scheduler.run(
+                str(params.get("self_id", "")),
+                self._send_target(action, params),
+                lambda: self._guarded_call(action, params),
+            )
+        else:
+            ret = await self._guarded_call(action, params)
+        if action in _SEND_ACTIONS and isinstance(ret, dict) and ret.get("message_id") is not None:
+            self._remember_sent_message(ret["message_id"], params.get("message"), params.get("self_id"))
+        return ret
+
+    # --- 发送媒体文件 ---
+
+    async def _prepare_media_chain(self, message_chain: MessageChain) -> MessageChain:
+        """将消息链中指向本地文件的图片、语音替换为已编码的 base64 或占位符，不修改原消息链"""
+        chain = None
+        for i, component in enumerate(message_chain.chain):
+            if not isinstance(component, (Image, Record)):
+                continue
+            path = _local_media_path(component)
+            file = await self._prepare_media_file(path) if path else None
+            if file is None:
+                continue
+            if chain is None:
+                chain = list(message_chain.chain)
+            chain[i] = type(component)(file=file)
+        if chain is None:
+            return message_chain
+        prepared = copy.copy(message_chain)
+        prepared.chain = chain
+        return prepared
+
+    async def _prepare_media_file(self, path: str) -> str | None:
+        if self.media_serve_mode in ("file", "http"):
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return None
+            if size >= self.media_serve_threshold:
+                # 上游发送逻辑会把图片、语音统一转为 base64:// 形式，
+                # 这里先放入占位符，调用发送接口时再替换为文件路径或下载地址
+                return _MEDIA_PLACEHOLDER + self._register_media(path)
+        if self._media_cache is not None:
+            payload = await self._media_cache.encode(path)
+            if payload is not None:
+                return f"base64://{payload}"
+        return None
+
+    def _register_media(self, path: str) -> str:
+        now = time.monotonic()
+        for token, (_, expires_at) in list(self._media_tokens.items()):
+            if expires_at <= now:
+                del self._media_tokens[token]
+        token = uuid.uuid4().hex
+        self._media_tokens[token] = (os.path.abspath(path), now + self.media_serve_token_ttl_sec)
+        return token
+
+    def _fill_media_placeholders(self, message: list) -> list:
+        filled = []
+        for segment in message:
+            data = segment.get("data") if isinstance(segment, dict) else None
+            file = data.get("file") if isinstance(data, dict) else None
+            if isinstance(file, str) and file.startswith(_MEDIA_PLACEHOLDER):
+                entry = self._media_tokens.get(file[len(_MEDIA_PLACEHOLDER):])
+                if entry is None:
+                    logger.error(f"媒体文件令牌已失效: {file}")
+                elif self.media_serve_mode == "http":
+                    url = f"{self.media_serve_url}/media/{file[len(_MEDIA_PLACEHOLDER):]}"
+                    segment = {**segment, "data": {**data, "file": url}}
+                else:
+                    del self._media_tokens[file[len(_MEDIA_PLACEHOLDER):]]
+                    segment = {**segment, "data": {**data, "file": pathlib.Path(entry[0]).as_uri()}}
+            filled.append(segment)
+        return filled
+
+    async def _serve_media(self, token: str) -> str | None:
+        entry = self._media_tokens.get(token)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def _start_media_server(self):
+        try:
+            await self._media_server.start()
+        except OSError as e:
+            logger.error(f"媒体文件 HTTP 服务启动失败，改为以 base64 发送: {e}")
+            self.media_serve_mode = "base64"
+            return
+        if not self.media_serve_url:
+            host = self._media_server.host
+            if host in ("", "0.0.0.0", "::"):
+                host = "127.0.0.1"
+            self.media_serve_url = f"http://{host}:{self._media_server.port}"
+        logger.info(f"媒体文件 HTTP 服务已启动: {self.media_serve_url}")
+
+    @staticmethod
+    def _send_target(action: str, params: dict) -> tuple[str, str]:
+        if action in ("send_group_msg", "send_group_forward_msg") or (
+            action == "send_msg" and (params.get("message_type") == "group" or (
+                params.get("message_type") is None and params.get("group_id")
+            ))
+        ):
+            return "group", str(params.get("group_id"))
+        return "private", str(params.get("user_id"))
+
+    def _action_timeout(self, action: str) -> float | None:
+        if action in self.api_timeouts:
+            return self.api_timeouts[action]
+        if action in _SEND_ACTIONS:
+            return self.api_send_timeout_sec
+        return None
+
+    async def _guarded_call(self, action: str, params: dict) -> Any:
+        """带超时的 API 调用"""
+        timeout = self._action_timeout(action)
+        started_at = time.perf_counter()
+        try:
+            return await asyncio.wait_for(self._bot_call_action(action, **params), timeout)
+        except asyncio.TimeoutError:
+            self._metrics.incr("api_timeouts", action)
+            self._api_timeouts += 1
+            raise asyncio.TimeoutError(f"OneBot API {action} 超过 {timeout} 秒未响应") from None
+        except Exception:
+            self._metrics.incr("api_errors", action)
+            raise
+        finally:
+            self._metrics.observe("api_call", time.perf_counter() - started_at, action)
+
+    def _create_background_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _get_group_member_info(self, self_id: str, group_id: int, user_id: str) -> dict | None:
+        """获取群成员信息，依次查找群成员名单索引、本地缓存与远程接口"""
+        roster = self._group_rosters.get(str(group_id))
+        if roster is not None:
+            self._group_rosters.move_to_end(str(group_id))
+            if str(user_id) in roster:
+                return roster[str(user_id)]
+        key = (str(group_id), str(user_id))
+        info = self._member_cache.get(key)
+        if info is None:
+            info = await self._lookup(self_id, "get_group_member_info", group_id=group_id, user_id=int(user_id), no_cache=False)
+            if info:
+                self._member_cache.set(key, info)
+                if roster is not None:
+                    roster[str(user_id)] = self._slim_member_info(info)
+        return info
+
+    # --- 群成员名单索引 ---
+
+    @staticmethod
+    def _slim_member_info(info: dict) -> dict:
+        """名单中只保留解析 @ 所需的字段"""
+        return {"card": info.get("card", ""), "nickname": info.get("nickname", "")}
+
+    def _ensure_group_roster(self, group_id: str, self_id: str | None, force: bool = False):
+        """群成员名单未加载或已过期时，在后台拉取"""
+        if not self.roster_prefetch_enable or group_id in self._roster_loading:
+            return
+        if group_id in self._group_rosters:
+            self._group_rosters.move_to_end(group_id)
+        elif (
+            len(self._group_rosters) + len(self._roster_loading.difference(self._group_rosters))
+            >= self.roster_max_groups
+        ):
+            # 已达上限时只淘汰已过期的名单：活跃群的名单过期即会重新加载，过期说明该群近期没有消息
+            oldest = next(iter(self._group_rosters), None)
+            if oldest is None or self._roster_fresh(oldest):
+                return
+            self._drop_group_roster(oldest)
+        if not force and self._roster_fresh(group_id):
+            return
+        self._roster_loading.add(group_id)
+        self._create_background_task(self._load_group_roster(group_id, self_id))
+
+    def _roster_fresh(self, group_id: str) -> bool:
+        loaded_at = self._roster_loaded_at.get(group_id)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.roster_refresh_sec
+
+    def _drop_group_roster(self, group_id: str):
+        self._group_rosters.pop(group_id, None)
+        self._roster_loaded_at.pop(group_id, None)
+        self._roster_accounts.pop(group_id, None)
+
+    async def _load_group_roster(self, group_id: str, self_id: str | None):
+        try:
+            async with self._roster_semaphore:
+                members = await self._account_call(self_id, "get_group_member_list", group_id=int(group_id), no_cache=False)
+        except Exception as e:
+            logger.warning(f"获取群 {group_id} 成员列表失败: {e}")
+            return
+        finally:
+            self._roster_loading.discard(group_id)
+        self._group_rosters[group_id] = {
+            str(m["user_id"]): self._slim_member_info(m) for m in members or []
+        }
+        self._group_rosters.move_to_end(group_id)
+        self._roster_loaded_at[group_id] = time.monotonic()
+        if self_id is not None:
+            self._roster_accounts[group_id] = self_id
+        while len(self._group_rosters) > self.roster_max_groups:
+            self._drop_group_roster(next(iter(self._group_rosters)))
+
+    async def _fetch_roster_member(self, group_id: str, user_id: str, self_id: str):
+        try:
+            info = await self._account_call(self_id, "get_group_member_info", group_id=int(group_id), user_id=int(user_id), no_cache=True)
+        except Exception as e:
+            logger.debug(f"获取新群成员 {user_id} 信息失败: {e}")
+            return
+        roster = self._group_rosters.get(group_id)
+        if info and roster is not None:
+            roster[user_id] = self._slim_member_info(info)
+
+    def _apply_member_notice(self, event: Event):
+        """根据群名片变更、入群、退群通知维护成员缓存与名单索引"""
+        group_id, user_id = str(event.group_id), str(event.user_id)
+        self._member_cache.pop((group_id, user_id))
+        roster = self._group_rosters.get(group_id)
+        if roster is None:
+            return
+        notice_type = event["notice_type"]
+        if notice_type == "group_card" and user_id in roster:
+            roster[user_id] = {**roster[user_id], "card": event.get("card_new", "")}
+        elif notice_type == "group_increase":
+            self._create_background_task(self._fetch_roster_member(group_id, user_id, str(event.self_id)))
+        elif notice_type == "group_decrease":
+            if user_id == str(event.self_id):
+                # 机器人自身退群或被移出，整个名单作废
+                self._drop_group_roster(group_id)
+            else:
+                roster.pop(user_id, None)
+
     # --- 聚合逻辑核心方法 ---
 
     async def handle_msg(self, message: AstrBotMessage):
@@ -335,75 +2168,307 @@ class AiocqhttpAdapter(Platform):
             await self._commit_message_event(message)
             return
 
-        session_id = message.session_id
+        buffer_key = self._buffer_key(message)
 
-        # 重置现有计时器
-        if session_id in self.user_message_buffers:
-            timer = self.user_message_buffers[session_id].get("timer")
-            if timer:
-                timer.cancel()
+        if buffer_key not in self.user_message_buffers:
+            while len(self.user_message_buffers) >= self.segment_max_buffers:
+                oldest_key = next(iter(self.user_message_buffers))
+                self._segment_early_flushes += 1
+                self._segment_scheduler.cancel(oldest_key)
+                await self._process_buffered_messages(oldest_key)
+            self.user_message_buffers[buffer_key] = {
+                "messages": [], "chars": 0, "created_at": time.perf_counter(),
+            }
+
+        # 存入缓冲区，合并时只会用到最后一段的原始事件，之前的分段裁剪掉原始数据
+        buffer = self.user_message_buffers[buffer_key]
+        if buffer["messages"]:
+            previous = buffer["messages"][-1]
+            previous.raw_message = Event({
+                k: previous.raw_message[k] for k in _RAW_HEADER_KEYS if k in previous.raw_message
+            })
+        buffer["messages"].append(message)
+        buffer["chars"] += len(message.message_str)
+
+        speculative = buffer.get("speculative")
+        if speculative is not None:
+            # 回复尚未发出，撤销推测提交的事件，稍后以扩展后的内容重新提交
+            speculative.cancel()
+            buffer["speculative"] = None
+            self._speculative_cancelled += 1
+
+        # 推迟该会话的处理时间
+        if self.segment_wait_mode == "adaptive":
+            wait_time = self._adaptive_wait.observe(buffer_key, is_new=len(buffer["messages"]) == 1)
         else:
-            self.user_message_buffers[session_id] = {"messages": [], "timer": None}
+            wait_time = self.segment_wait_time
+        if self.segment_eou_enable:
+            eou_wait = self.eou_detector.check(message, buffer["messages"])
+            if eou_wait is not None:
+                wait_time = min(wait_time, eou_wait)
 
-        # 存入缓冲区
-        self.user_message_buffers[session_id]["messages"].append(message)
+        if (
+            len(buffer["messages"]) >= self.segment_max_fragments
+            or buffer["chars"] >= self.segment_max_chars
+        ):
+            self._segment_early_flushes += 1
+            wait_time = 0
 
-        # 开启新计时器
-        self.user_message_buffers[session_id]["timer"] = asyncio.create_task(
-            self._schedule_processing(session_id)
-        )
+        if wait_time <= 0:
+            self._segment_scheduler.cancel(buffer_key)
+            await self._process_buffered_messages(buffer_key)
+            return
+        self._segment_scheduler.schedule(buffer_key, wait_time)
+        if self.segment_speculative_enable:
+            self._speculative_scheduler.schedule(
+                buffer_key, min(self.segment_speculative_idle_sec, wait_time)
+            )
+
+    def _buffer_key(self, message: AstrBotMessage) -> str:
+        """聚合缓冲区的键。群聊可按发送者分别聚合，提交时仍使用群会话"""
+        if self.segment_group_per_sender and message.type == MessageType.GROUP_MESSAGE:
+            return f"{message.session_id}:{message.sender.user_id}"
+        return message.session_id
+
+    async def _drain_buffers(self, reason: str, self_id: str | None = None) -> int:
+        """立即处理缓冲中的会话（可按账号筛选），返回已处理的数量"""
+        buffer_keys = [
+            key for key, buffer in self.user_message_buffers.items()
+            if self_id is None or any(m.self_id == self_id for m in buffer["messages"])
+        ]
+        if not buffer_keys:
+            return 0
+        flushed = 0
+
+        async def drain():
+            nonlocal flushed
+            for buffer_key in buffer_keys:
+                self._segment_scheduler.cancel(buffer_key)
+                self._speculative_scheduler.cancel(buffer_key)
+                await self._process_buffered_messages(buffer_key)
+                flushed += 1
 
-    async def _schedule_processing(self, session_id: str):
         try:
-            await asyncio.sleep(self.segment_wait_time)
-            await self._process_buffered_messages(session_id)
-        except asyncio.CancelledError:
-            pass 
+            await asyncio.wait_for(drain(), self.segment_drain_timeout_sec)
+        except asyncio.TimeoutError:
+            pass
         except Exception as e:
-            logger.error(f"调度聚合任务出错: {e}")
-            if session_id in self.user_message_buffers:
-                del self.user_message_buffers[session_id]
+            logger.error(f"处理缓冲消息出错: {e}")
+        self._segment_drained += flushed
+        dropped = len(buffer_keys) - flushed
+        logger.info(
+            f"aiocqhttp: {reason}，已立即处理 {flushed} 个缓冲中的会话"
+            + (f"，{dropped} 个因超时未处理" if dropped else "")
+        )
+        return flushed
+
+    def _build_eou_detector(self) -> EndOfUtteranceDetector:
+        """根据配置构建默认的输入结束判断规则"""
+        detector = EndOfUtteranceDetector()
+        eou_wait: float = self.config.get("segment_eou_wait_sec", 1.5)
+        punctuation: str = self.config.get("segment_eou_punctuation", "。！？!?…~")
+        patterns = [re.compile(p) for p in self.config.get("segment_eou_patterns", [])]
 
-    async def _process_buffered_messages(self, session_id: str):
-        if session_id not in self.user_message_buffers:
+        def terminal_punctuation(message, buffered):
+            text = message.message_str.rstrip()
+            return eou_wait if text and text[-1] in punctuation else None
+
+        def media_after_text(message, buffered):
+            # 先发文字、再补一张图片/文件，通常意味着输入结束
+            if message.message_str or len(buffered) < 2:
+                return None
+            if any(isinstance(c, (Image, File, Record, Video)) for c in message.message):
+                return eou_wait if any(m.message_str for m in buffered[:-1]) else None
+            return None
+
+        def at_self(message, buffered):
+            return eou_wait if any(
+                isinstance(c, At) and str(c.qq) == message.self_id for c in message.message
+            ) else None
+
+        def custom_patterns(message, buffered):
+            return 0 if any(p.search(message.message_str) for p in patterns) else None
+
+        for rule in (terminal_punctuation, media_after_text, at_self):
+            detector.register(rule)
+        if patterns:
+            detector.register(custom_patterns)
+        return detector
+
+    @staticmethod
+    def _is_input_status(event: Event) -> bool:
+        """NapCat/Lagrange 的输入状态通知"""
+        return event.get("notice_type") == "notify" and event.get("sub_type") == "input_status"
+
+    def _handle_input_status(self, event: Event):
+        self._typing_notices += 1
+        # 输入状态通知只出现在私聊，缓冲区键即为用户 id
+        buffer_key = str(event.user_id)
+        if not self.segment_typing_enable or buffer_key not in self.user_message_buffers:
             return
+        # event_type 为 1 表示正在输入
+        if event.get("event_type") == 1:
+            remaining = self._segment_scheduler.remaining(buffer_key) or 0
+            opened_for = time.perf_counter() - self.user_message_buffers[buffer_key]["created_at"]
+            extend = min(self.segment_typing_extend_sec, self.segment_typing_max_wait_sec - opened_for)
+            self._segment_scheduler.schedule(buffer_key, max(remaining, extend))
+        else:
+            self._segment_scheduler.schedule(buffer_key, self.segment_typing_stop_wait_sec)
 
-        buffered_data = self.user_message_buffers.pop(session_id)
+    async def _flush_expired_sessions(self, buffer_keys: list[str]):
+        for buffer_key in buffer_keys:
+            try:
+                await self._process_buffered_messages(buffer_key)
+            except Exception as e:
+                logger.error(f"调度聚合任务出错: {e}")
+                self.user_message_buffers.pop(buffer_key, None)
+
+    async def _process_buffered_messages(self, buffer_key: str):
+        if buffer_key not in self.user_message_buffers:
+            return
+
+        buffered_data = self.user_message_buffers.pop(buffer_key)
+        self._speculative_scheduler.cancel(buffer_key)
         message_list = buffered_data.get("messages", [])
         if not message_list:
             return
+        self._metrics.observe("aggregation_wait", time.perf_counter() - buffered_data["created_at"])
+        self._metrics.incr("aggregated_fragments", n=len(message_list))
 
-        final_message = message_list[0]
-        if len(message_list) > 1:
-            combined_chain = list(final_message.message)
-            combined_str = final_message.message_str
-
-            for i in range(1, len(message_list)):
-                next_msg = message_list[i]
-                if combined_str and next_msg.message_str:
-                    combined_str += "\n"
-                combined_str += next_msg.message_str
-                combined_chain.extend(next_msg.message)
-            
-            final_message.message = combined_chain
-            final_message.message_str = combined_str.strip()
-            # 采用最后一段消息的上下文
-            final_message.message_id = message_list[-1].message_id
-            final_message.raw_message = message_list[-1].raw_message
-
-        logger.info(f"聚合消息完毕 ({session_id}): {final_message.message_str}")
+        speculative = buffered_data.get("speculative")
+        if speculative is not None and not speculative.cancelled:
+            # 推测提交的事件已包含全部分段，无需再次提交
+            return
+
+        final_message = self._merge_messages(message_list)
+        logger.info(f"聚合消息完毕 ({buffer_key}): {final_message.message_str}")
         await self._commit_message_event(final_message)
 
-    async def _commit_message_event(self, message: AstrBotMessage):
+    @staticmethod
+    def _merge_messages(message_list: list[AstrBotMessage]) -> AstrBotMessage:
+        """合并缓冲区中的分段消息，不修改缓冲区中的原消息"""
+        if len(message_list) == 1:
+            return message_list[0]
+
+        final_message = copy.copy(message_list[0])
+        combined_chain = list(final_message.message)
+        combined_str = final_message.message_str
+
+        for i in range(1, len(message_list)):
+            next_msg = message_list[i]
+            if combined_str and next_msg.message_str:
+                combined_str += "\n"
+            combined_str += next_msg.message_str
+            combined_chain.extend(next_msg.message)
+
+        final_message.message = combined_chain
+        final_message.message_str = combined_str.strip()
+        # 采用最后一段消息的上下文
+        final_message.message_id = message_list[-1].message_id
+        final_message.raw_message = message_list[-1].raw_message
+        return final_message
+
+    async def _dispatch_speculative(self, buffer_keys: list[str]):
+        for buffer_key in buffer_keys:
+            buffer = self.user_message_buffers.get(buffer_key)
+            if not buffer or not buffer["messages"] or buffer.get("speculative") is not None:
+                continue
+            message = self._merge_messages(buffer["messages"])
+            logger.debug(f"推测提交聚合消息 ({buffer_key}): {message.message_str}")
+            buffer["speculative"] = await self._commit_message_event(
+                message,
+                on_first_send=lambda key=buffer_key: self._finalize_speculative(key),
+            )
+
+    def _finalize_speculative(self, buffer_key: str):
+        """推测提交的事件开始发送回复，本轮输入到此结束，之后的分段进入新的缓冲区"""
+        buffer = self.user_message_buffers.get(buffer_key)
+        if buffer is None or buffer.get("speculative") is None:
+            return
+        del self.user_message_buffers[buffer_key]
+        self._segment_scheduler.cancel(buffer_key)
+        self._speculative_scheduler.cancel(buffer_key)
+
+    async def _commit_message_event(
+        self,
+        message: AstrBotMessage,
+        on_first_send: Callable[[], None] | None = None,
+    ) -> _AdapterMessageEvent | None:
         """统一提交事件的方法"""
-        message_event = AiocqhttpMessageEvent(
+        if self._ipc is not None:
+            # 工作进程中的事件交给主进程提交
+            self._send_to_main(message)
+            return None
+        self._remember_session_account(message)
+        message_event = _AdapterMessageEvent(
             message_str=message.message_str,
             message_obj=message,
             platform_meta=self.meta(),
             session_id=message.session_id,
             bot=self.bot,
         )
-        self.commit_event(message_event)
+        message_event.on_first_send = on_first_send
+        message_event.prepare_chain = self._prepare_media_chain
+        priority = self._commit_priority(message)
+        if (
+            priority == _PRIORITY_GROUP
+            and self.commit_shed_policy != "none"
+            and self._lane.pending(_PRIORITY_GROUP) >= self.commit_shed_threshold
+        ):
+            self._shed_message_event(message_event)
+            return message_event
+        self._lane.submit(priority, message_event)
+        return message_event
+
+    def _remember_session_account(self, message: AstrBotMessage):
+        """记录会话最近一次收到消息的账号，供不经事件的发送（如 send_by_session）选择账号"""
+        if message.type == MessageType.GROUP_MESSAGE:
+            key = ("group", str(message.group_id))
+        elif message.type == MessageType.FRIEND_MESSAGE:
+            key = ("private", str(message.sender.user_id))
+        else:
+            return
+        self._session_accounts[key] = str(message.self_id)
+        self._session_accounts.move_to_end(key)
+        while len(self._session_accounts) > 10000:
+            self._session_accounts.popitem(last=False)
+
+    @staticmethod
+    def _commit_priority(message: AstrBotMessage) -> int:
+        if message.raw_message.get("post_type") != "message":
+            return _PRIORITY_NOTICE
+        if message.message_str.strip().startswith("/"):
+            return _PRIORITY_COMMAND
+        if message.type == MessageType.GROUP_MESSAGE:
+            return _PRIORITY_GROUP
+        return _PRIORITY_PRIVATE
+
+    def _shed_message_event(self, message_event: _AdapterMessageEvent):
+        """负载过高时按策略处理低优先级的群聊消息"""
+        self._shed_events += 1
+        message = message_event.message_obj
+        if self.commit_shed_policy == "merge":
+            pending = self._lane.find_pending(
+                lambda e: e.message_obj.session_id == message.session_id
+                and e.message_obj.sender.user_id == message.sender.user_id
+            )
+            if pending is not None:
+                pending.message_obj = self._merge_messages([pending.message_obj, message])
+                pending.message_str = pending.message_obj.message_str
+                message_event.cancel()
+                return
+        elif self.commit_shed_policy == "busy":
+            self._create_background_task(self._reply_busy(message_event))
+            return
+        logger.warning(f"aiocqhttp: 消息积压，丢弃群聊消息 ({message.session_id}): {message.message_str}")
+        message_event.cancel()
+
+    async def _reply_busy(self, message_event: _AdapterMessageEvent):
+        try:
+            await message_event.send(MessageChain([Plain(self.commit_shed_busy_text)]))
+        except Exception as e:
+            logger.error(f"回复繁忙提示失败: {e}")
+        message_event.cancel()
 
     # --- 基础方法 ---
 
@@ -413,27 +2478,455 @@ class AiocqhttpAdapter(Platform):
             self.host = "0.0.0.0"
             self.port = 6199
 
-        coro = self.bot.run_task(
-            host=self.host,
-            port=int(self.port),
-            shutdown_trigger=self.shutdown_trigger_placeholder,
-        )
+        if self.worker_processes > 0:
+            coro = self._serve_workers()
+        else:
+            coro = self.bot.run_task(
+                host=self.host,
+                port=int(self.port),
+                shutdown_trigger=self.shutdown_trigger_placeholder,
+            )
 
         for handler in logging.root.handlers[:]:
             logging.root.removeHandler(handler)
         logging.getLogger("aiocqhttp").setLevel(logging.ERROR)
         self.shutdown_event = asyncio.Event()
-        return coro
+        return self._serve(coro)
+
+    async def _serve(self, server: Awaitable[Any]):
+        if self._media_server is not None:
+            await self._start_media_server()
+        if self._metrics_server is not None:
+            try:
+                await self._metrics_server.start()
+                logger.info(
+                    f"aiocqhttp: 指标接口已启动: http://{self._metrics_server.host}:{self._metrics_server.port}/metrics"
+                )
+            except OSError as e:
+                logger.error(f"aiocqhttp: 指标接口启动失败: {e}")
+                self._metrics_server = None
+        if self.cache_snapshot_enable and self.worker_processes <= 0:
+            await self._load_cache_snapshot()
+            self._create_background_task(self._cache_snapshot_loop())
+        await server
 
     async def terminate(self):
+        if self.worker_processes > 0:
+            await self._stop_workers()
+        if self._workers is not None:
+            await self._workers.join(self.segment_drain_timeout_sec)
+            self._workers.close()
+        await self._drain_buffers("适配器正在关闭")
+        self._lane.flush()
+        self._segment_scheduler.close()
+        self._speculative_scheduler.close()
+        self._notice_scheduler.close()
         self.shutdown_event.set()
+        if self._media_server is not None:
+            await self._media_server.close()
+        if self._metrics_server is not None:
+            await self._metrics_server.close()
+        if self.cache_snapshot_enable and self.worker_processes <= 0:
+            await self._save_cache_snapshot()
 
     async def shutdown_trigger_placeholder(self):
         await self.shutdown_event.wait()
         logger.info("aiocqhttp 适配器已被关闭")
 
+    # --- 多进程模式 ---
+
+    def _worker_config(self, index: int) -> dict:
+        config = dict(self.config)
+        root, ext = os.path.splitext(self._snapshot.path)
+        config.update(
+            ws_reverse_host=self.host,
+            ws_reverse_port=int(self.port) + index,
+            worker_processes=0,
+            # 推测提交需要与流水线中的事件对象交互，文件解析器无法跨进程传递
+            segment_speculative_enable=False,
+            file_lazy_resolve=False,
+            # 回复由主进程发送，媒体文件在主进程中处理
+            media_serve_mode="base64",
+            cache_snapshot_path=f"{root}.w{index}{ext}",
+            # 指标由主进程汇总后统一对外提供，工作进程不再监听同一端口
+            metrics_http_enable=False,
+        )
+        return config
+
+    async def _serve_workers(self):
+        server = await asyncio.start_server(self._accept_worker, "127.0.0.1", 0)
+        ipc_port = server.sockets[0].getsockname()[1]
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.worker_processes):
+            self._create_background_task(self._supervise_worker(context, index, ipc_port))
+        logger.info(
+            f"aiocqhttp: 多进程模式，{self.worker_processes} 个工作进程监听 "
+            f"{self.host}:{self.port}-{int(self.port) + self.worker_processes - 1}"
+        )
+        try:
+            await self.shutdown_event.wait()
+        finally:
+            server.close()
+
+    async def _supervise_worker(self, context, index: int, ipc_port: int):
+        """启动工作进程，意外退出时重启；连续启动失败时逐渐延长重启间隔，达到上限后放弃"""
+        from .aiocqhttp_worker import main as worker_main
+
+        failures = 0
+        while not self._workers_stopping:
+            process = context.Process(
+                target=worker_main,
+                args=(self._worker_config(index), self.settings, index, ipc_port, self._ipc_authkey),
+                name=f"aiocqhttp-worker-{index}",
+                daemon=True,
+            )
+            started_at = time.monotonic()
+            process.start()
+            self._worker_procs[index] = process
+            while process.is_alive():
+                await asyncio.sleep(1)
+            if self._workers_stopping:
+                return
+            if time.monotonic() - started_at < _WORKER_STARTUP_GRACE:
+                failures += 1
+            else:
+                failures = 0
+            if failures >= _WORKER_RESTART_LIMIT:
+                logger.error(
+                    f"aiocqhttp: 工作进程 {index} 连续 {failures} 次启动后立即退出（退出码 {process.exitcode}），"
+                    f"不再重启，端口 {int(self.port) + index} 将无法连接"
+                )
+                return
+            delay = 5 * 2 ** max(failures - 1, 0)
+            logger.error(
+                f"aiocqhttp: 工作进程 {index} 意外退出（退出码 {process.exitcode}），{delay} 秒后重启"
+            )
+            await asyncio.sleep(delay)
+
+    async def _accept_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channel = _IpcChannel(reader, writer)
+        try:
+            # 首条消息为明文的 "<authkey>:<index>"，验证通过后才解析 pickle 数据
+            authkey, _, index = (await asyncio.wait_for(channel.recv_raw(), 10)).decode().partition(":")
+            if not hmac.compare_digest(authkey, self._ipc_authkey):
+                raise ValueError("进程间通道认证失败")
+            index = int(index)
+        except Exception as e:
+            logger.warning(f"aiocqhttp: 拒绝工作进程连接: {e}")
+            channel.close()
+            return
+        self._worker_channels[index] = channel
+        try:
+            while True:
+                await self._handle_worker_message(index, await channel.recv())
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._worker_channels.get(index) is channel:
+                del self._worker_channels[index]
+            for account, owner in list(self._account_workers.items()):
+                if owner == index:
+                    del self._account_workers[account]
+            for call_id, (owner, future) in list(self._remote_calls.items()):
+                if owner == index and not future.done():
+                    future.set_exception(ConnectionError(f"工作进程 {index} 已断开"))
+            channel.close()
+
+    async def _handle_worker_message(self, index: int, message: tuple):
+        kind = message[0]
+        if kind == "event":
+            abm: AstrBotMessage = message[1]
+            abm.raw_message = Event(abm.raw_message)
+            if abm.type == MessageType.GROUP_MESSAGE:
+                self._remember_session_worker(("group", str(abm.group_id)), index)
+            elif abm.type == MessageType.FRIEND_MESSAGE:
+                self._remember_session_worker(("private", str(abm.sender.user_id)), index)
+            await self._commit_message_event(abm)
+        elif kind == "online":
+            self._account_workers[message[1]] = index
+        elif kind == "metrics":
+            self._worker_metrics[index] = message[1]
+        elif kind == "result":
+            entry = self._remote_calls.get(message[1])
+            if entry is not None and not entry[1].done():
+                entry[1].set_result(message[2:])
+
+    def _remember_session_worker(self, key: tuple[str, str], index: int):
+        self._session_workers[key] = index
+        self._session_workers.move_to_end(key)
+        while len(self._session_workers) > 10000:
+            self._session_workers.popitem(last=False)
+
+    def _route_worker(self, params: dict) -> int | None:
+        """依次按 self_id、会话最近所在的工作进程选择，都没有时选择任意在线的工作进程"""
+        self_id = params.get("self_id")
+        if self_id is not None and self._account_workers.get(str(self_id)) in self._worker_channels:
+            return self._account_workers[str(self_id)]
+        if params.get("group_id") is not None:
+            key = ("group", str(params["group_id"]))
+        else:
+            key = ("private", str(params.get("user_id")))
+        index = self._session_workers.get(key)
+        if index in self._worker_channels:
+            return index
+        return next(iter(self._worker_channels), None)
+
+    async def _call_worker(self, action: str, **params) -> Any:
+        """主进程中的 API 调用，转发给持有对应连接的工作进程执行"""
+        index = self._route_worker(params)
+        if index is None:
+            raise ConnectionError(f"OneBot API {action} 调用失败：没有已连接的工作进程")
+        call_id = next(self._remote_call_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._remote_calls[call_id] = (index, future)
+        try:
+            self._worker_channels[index].send(("call", call_id, action, params))
+            ok, value = await future
+        finally:
+            self._remote_calls.pop(call_id, None)
+        if ok:
+            return value
+        kind, detail = value
+        if kind == "ActionFailed":
+            raise ActionFailed(detail)
+        raise RuntimeError(f"OneBot API {action} 调用失败: {detail}")
+
+    async def _serve_remote_call(self, call_id: int, action: str, params: dict):
+        """工作进程中执行主进程转发的 API 调用"""
+        try:
+            ret = await self._bot_call_action(action, **params)
+        except ActionFailed as e:
+            result = (False, ("ActionFailed", getattr(e, "result", None)))
+        except Exception as e:
+            result = (False, (type(e).__name__, str(e)))
+        else:
+            result = (True, ret)
+            if action in _SEND_ACTIONS and isinstance(ret, dict) and ret.get("message_id") is not None:
+                self._remember_sent_message(ret["message_id"], params.get("message"), params.get("self_id"))
+        try:
+            self._ipc.send(("result", call_id, *result))
+        except ConnectionError as e:
+            logger.warning(f"aiocqhttp: 返回 API 调用结果失败: {e}")
+
+    def _send_to_main(self, message: AstrBotMessage):
+        # 原始事件以普通 dict 传递，由主进程还原为 Event
+        message.raw_message = dict(message.raw_message)
+        try:
+            self._ipc.send(("event", message))
+        except Exception as e:
+            logger.error(f"aiocqhttp: 提交事件到主进程失败: {e}")
+
+    async def _stop_workers(self):
+        self._workers_stopping = True
+        for channel in list(self._worker_channels.values()):
+            try:
+                channel.send(("stop",))
+            except ConnectionError:
+                pass
+        # 工作进程退出前会提交缓冲区中的消息，等到通道关闭即表示这些消息都已收到
+        deadline = time.monotonic() + self.segment_drain_timeout_sec + 5
+        while (
+            self._worker_channels or any(p.is_alive() for p in self._worker_procs.values())
+        ) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for index, process in self._worker_procs.items():
+            if process.is_alive():
+                logger.warning(f"aiocqhttp: 工作进程 {index} 未能按时退出，强制结束")
+                process.terminate()
+
+    # --- 缓存快照 ---
+
+    def _dump_caches(self) -> list[tuple[str, str, Any, float]]:
+        entries = [
+            ("member", json.dumps(key), value, expires_at)
+            for key, value, expires_at in self._member_cache.dump()
+        ]
+        # 引用消息只保存文本，恢复后消息链退化为纯文本
+        entries.extend(
+            ("message", json.dumps(key), list(value[:5]), expires_at)
+            for key, value, expires_at in self._recent_messages.dump()
+        )
+        now, wall = time.monotonic(), time.time()
+        for group_id, roster in self._group_rosters.items():
+            loaded_at = wall - (now - self._roster_loaded_at.get(group_id, now))
+            account = self._roster_accounts.get(group_id)
+            entries.append(("roster", group_id, [account, roster], loaded_at + self.roster_refresh_sec))
+        return entries
+
+    def _restore_caches(self, entries: list[tuple[str, str, Any, float]]):
+        members, messages = [], []
+        now, wall = time.monotonic(), time.time()
+        for kind, key, value, expires_at in entries:
+            if kind == "member":
+                members.append((tuple(json.loads(key)), value, expires_at))
+            elif kind == "message":
+                if not key.startswith("["):
+                    # 旧版快照的键不含 self_id，无法确定所属账号
+                    continue
+                key = json.loads(key)
+                message_str = value[4]
+                chain = [Plain(text=message_str)] if message_str else []
+                messages.append((tuple(key), _RecentMessage(*value, chain), expires_at))
+            elif kind == "roster" and key not in self._group_rosters:
+                # 旧版快照只保存名单本身
+                account, value = value if isinstance(value, list) else (None, value)
+                self._group_rosters[key] = value
+                if account is not None:
+                    self._roster_accounts[key] = account
+                self._roster_loaded_at[key] = now - (wall - (expires_at - self.roster_refresh_sec))
+        self._member_cache.load(members)
+        self._recent_messages.load(messages)
+
+    async def _load_cache_snapshot(self):
+        try:
+            entries = await asyncio.to_thread(self._snapshot.load, self.cache_snapshot_max_age_sec)
+            self._restore_caches(entries)
+            logger.info(f"aiocqhttp: 已从 {self._snapshot.path} 恢复 {len(entries)} 条缓存。")
+        except Exception as e:
+            logger.warning(f"aiocqhttp: 读取缓存快照失败: {e}")
+
+    async def _save_cache_snapshot(self):
+        try:
+            await asyncio.to_thread(self._snapshot.save, self._dump_caches())
+        except Exception as e:
+            logger.warning(f"aiocqhttp: 写入缓存快照失败: {e}")
+
+    async def _cache_snapshot_loop(self):
+        while not self.shutdown_event.is_set():
+            try:
+                await asyncio.wait_for(self.shutdown_event.wait(), self.cache_snapshot_interval_sec)
+            except asyncio.TimeoutError:
+                await self._save_cache_snapshot()
+
     def meta(self) -> PlatformMetadata:
         return self.metadata
 
     def get_client(self) -> CQHttp:
-        return self.bot
\ No newline at end of file
+        return self.bot
+
+    def get_metrics(self) -> dict:
+        """各处理阶段的耗时分布（秒）与计数，多进程模式下附带各工作进程最近上报的数据"""
+        metrics = self._metrics.snapshot()
+        if self.worker_processes > 0:
+            metrics["workers"] = {
+                index: _Metrics.from_export(export).snapshot()
+                for index, export in self._worker_metrics.items()
+            }
+        return metrics
+
+    async def _serve_metrics(self, path: str) -> tuple[str, bytes] | None:
+        if path not in ("", "/"):
+            return None
+        prefix = "astrbot_aiocqhttp"
+        exports = [("", self._metrics.export())]
+        exports.extend(
+            (f'worker="{index}"', export) for index, export in sorted(self._worker_metrics.items())
+        )
+        lines = _Metrics.render_prometheus(exports, prefix)
+        gauges = {
+            "buffered_sessions": len(self.user_message_buffers),
+            "commit_inflight": self._lane.inflight(),
+            "send_pending": self._send_scheduler.stats()["pending"],
+            "api_breaker_open": int(self._breaker.opened_at is not None),
+        }
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value}")
+        lines.append(f"# TYPE {prefix}_commit_pending gauge")
+        for priority in (_PRIORITY_NOTICE, _PRIORITY_PRIVATE, _PRIORITY_GROUP):
+            lines.append(
+                f'{prefix}_commit_pending{{priority="{_PRIORITY_NAMES[priority]}"}} {self._lane.pending(priority)}'
+            )
+        return "text/plain; version=0.0.4; charset=utf-8", ("\n".join(lines) + "\n").encode()
+
+    def get_stats(self) -> dict:
+        """适配器内部缓存等运行统计"""
+        return {
+            "member_cache": self._member_cache.stats(),
+            "recent_messages": self._recent_messages.stats(),
+            "file_urls": self._file_urls.stats(),
+            "ingest": self._workers.stats() if self._workers else None,
+            "commit": {
+                "inflight": self._lane.inflight(),
+                "pending": {
+                    "notice": self._lane.pending(_PRIORITY_NOTICE),
+                    "private": self._lane.pending(_PRIORITY_PRIVATE),
+                    "group": self._lane.pending(_PRIORITY_GROUP),
+                },
+                "shed": self._shed_events,
+            },
+            "notice": {
+                "filtered": self._notices_filtered,
+                "coalesced": self._notices_coalesced,
+            },
+            "coalesce": self._single_flight.stats(),
+            "send": self._send_scheduler.stats(),
+            "media_cache": self._media_cache.stats() if self._media_cache else None,
+            "media_serve": {
+                "mode": self.media_serve_mode,
+                "tokens": len(self._media_tokens),
+            },
+            "api": {
+                "timeouts": self._api_timeouts,
+                "breaker": self._breaker.stats(),
+            },
+            "dedup": {
+                "size": len(self._seen_messages),
+                "duplicates": self._seen_messages.hits,
+            },
+            "segment": {
+                "buffered_sessions": len(self.user_message_buffers),
+                "adaptive_sessions": len(self._adaptive_wait),
+                "typing_notices": self._typing_notices,
+                "early_flushes": self._segment_early_flushes,
+                "speculative_cancelled": self._speculative_cancelled,
+                "drained": self._segment_drained,
+            },
+            "workers": {
+                "processes": self.worker_processes,
+                "connected": sorted(self._worker_channels),
+                "accounts": dict(self._account_workers),
+                "pending_calls": len(self._remote_calls),
+            } if self.worker_processes > 0 else None,
+            "rosters": {
+                "groups": len(self._group_rosters),
+                "members": sum(len(r) for r in self._group_rosters.values()),
+            },
+        }
+
+
+# --- 工作进程入口 ---
+
+async def _run_worker(
+    platform_config: dict, platform_settings: dict, index: int, ipc_port: int, authkey: str
+):
+    reader, writer = await asyncio.open_connection("127.0.0.1", ipc_port)
+    channel = _IpcChannel(reader, writer)
+    channel.send_raw(f"{authkey}:{index}".encode())
+    adapter = AiocqhttpAdapter(platform_config, platform_settings, asyncio.Queue())
+    adapter._ipc = channel
+    server = asyncio.ensure_future(adapter.run())
+    adapter._create_background_task(_report_worker_metrics(adapter, channel))
+    try:
+        while True:
+            message = await channel.recv()
+            if message[0] == "call":
+                adapter._create_background_task(adapter._serve_remote_call(*message[1:]))
+            elif message[0] == "stop":
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        logger.warning(f"aiocqhttp: 工作进程 {index} 与主进程的连接已断开")
+    finally:
+        await adapter.terminate()
+        await server
+        channel.close()
+
+
+async def _report_worker_metrics(adapter: AiocqhttpAdapter, channel: _IpcChannel):
+    """定期将工作进程的指标上报给主进程"""
+    while adapter._metrics.enabled:
+        await asyncio.sleep(_WORKER_METRICS_INTERVAL)
+        try:
+            channel.send(("metrics", adapter._metrics.export()))
+        except ConnectionError:
+            return
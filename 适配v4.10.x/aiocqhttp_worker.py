@@ -0,0 +1,15 @@
+"""aiocqhttp 适配器多进程模式下工作进程的入口
+
+工作进程以 spawn 方式启动，子进程中首先导入的是本模块。适配器模块需在 astrbot.api 之后导入，
+否则 astrbot.core 的循环导入会使子进程启动失败，因此入口不放在适配器模块中。
+"""
+
+import asyncio
+
+import astrbot.api  # noqa: F401  须先于适配器模块导入
+
+from .aiocqhttp_platform_adapter import _run_worker
+
+
+def main(platform_config: dict, platform_settings: dict, index: int, ipc_port: int, authkey: str):
+    asyncio.run(_run_worker(platform_config, platform_settings, index, ipc_port, authkey))